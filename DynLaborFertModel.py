@@ -1,325 +1,2505 @@
-import numpy as np
-from scipy.optimize import minimize,  NonlinearConstraint
-import warnings
-warnings.filterwarnings("ignore", message="delta_grad == 0.0. Check if the approximated function is linear.") # turn of annoying warning
-
-from EconModel import EconModelClass
-
-from consav.grids import nonlinspace
-from consav.linear_interp import interp_2d
-from tqdm import tqdm
-
-class DynLaborFertModelClass(EconModelClass):
-
-    def settings(self):
-        """ fundamental settings """
-
-        pass
-
-    def setup(self):
-        """ set baseline parameters """
-
-        # unpack
-        par = self.par
-
-        par.T = 10 # time periods
-        
-        # preferences
-        par.rho = 0.98 # discount factor
-
-        par.beta_0 = 0.1 # weight on labor dis-utility (constant)
-        par.beta_1 = 0.05 # additional weight on labor dis-utility (children)
-        par.eta = -2.0 # CRRA coefficient
-        par.gamma = 2.5 # curvature on labor hours 
-
-        # income
-        par.alpha = 0.1 # human capital accumulation 
-        par.w = 1.0 # wage base level
-        par.tau = 0.1 # labor income tax
-
-        # children
-        par.p_birth = 0.1
-        par.p_spouse = 1.0
-        par.theta = 0.00 # Childcare cost
-
-        # saving
-        par.r = 0.02 # interest rate
-
-        # grids
-        par.a_max = 5.0 # maximum point in wealth grid
-        par.a_min = -10.0 # minimum point in wealth grid
-        par.Na = 50 #70 # number of grid points in wealth grid 
-        
-        par.k_max = 20.0 # maximum point in wealth grid
-        par.Nk = 20 #30 # number of grid points in wealth grid    
-
-        par.Nn = 2 # number of children
-        par.spouse_dummy = 0 # 1 if spouse, 0 if not
-        par.Ns = 2 # number of spouse states
-
-        # simulation
-        par.simT = par.T # number of periods
-        par.simN = 1_000 # number of individuals
-
-
-    def allocate(self):
-        """ allocate model """
-
-        # unpack
-        par = self.par
-        sol = self.sol
-        sim = self.sim
-
-        par.simT = par.T
-        
-        # a. asset grid
-        par.a_grid = nonlinspace(par.a_min,par.a_max,par.Na,1.1)
-
-        # b. human capital grid
-        par.k_grid = nonlinspace(0.0,par.k_max,par.Nk,1.1)
-
-        # c. number of children grid
-        par.n_grid = np.arange(par.Nn)
-
-        # d. Spouse grid
-        par.spouse_grid = np.arange(par.Ns)
-
-        # d. solution arrays
-        shape = (par.T,par.Nn, par.Ns, par.Na,par.Nk)
-        sol.c = np.nan + np.zeros(shape)
-        sol.h = np.nan + np.zeros(shape)
-        sol.V = np.nan + np.zeros(shape)
-
-        # e. simulation arrays
-        shape = (par.simN,par.simT)
-        sim.c = np.nan + np.zeros(shape)
-        sim.h = np.nan + np.zeros(shape)
-        sim.a = np.nan + np.zeros(shape)
-        sim.k = np.nan + np.zeros(shape)
-        sim.n = np.zeros(shape,dtype=np.int_)
-        sim.s = np.zeros(shape,dtype=np.int_)
-
-        # f. draws used to simulate child arrival and spouse
-        np.random.seed(9210)
-        sim.draws_uniform = np.random.uniform(size=shape)
-        sim.draws_uniform_spouse = np.random.uniform(size=shape)
-
-        # g. initialization
-        sim.a_init = np.zeros(par.simN)
-        sim.k_init = np.zeros(par.simN)
-        sim.n_init = np.zeros(par.simN,dtype=np.int_)
-
-        # h. vector of wages. Used for simulating elasticities
-        par.w_vec = par.w * np.ones(par.T)
-
-
-    ############
-    # Solution #
-    def solve(self):
-
-        # a. unpack
-        par = self.par
-        sol = self.sol
-        
-        # b. solve last period
-        
-        # c. loop backwards (over all periods)
-        for t in tqdm(reversed(range(par.T))):
-
-            # i. loop over state variables: number of children, human capital and wealth in beginning of period
-            for i_n,kids in enumerate(par.n_grid):
-                for i_a,assets in enumerate(par.a_grid):
-                    for i_k,capital in enumerate(par.k_grid):
-                            for i_s,spouse in enumerate(par.spouse_grid):
-                                idx = (t,i_n,i_s,i_a,i_k)
-
-                                # ii. find optimal consumption and hours at this level of wealth in this period t.
-
-                                if t==par.T-1: # last period
-                                    obj = lambda x: self.obj_last(x[0],assets,capital,kids,spouse)
-
-                                    constr = lambda x: self.cons_last(x[0],assets,capital,kids,spouse)
-                                    nlc = NonlinearConstraint(constr, lb=0.0, ub=np.inf,keep_feasible=True)
-
-                                    # call optimizer
-                                    hours_min = - assets / self.wage_func(capital,t) + 1.0e-5 # minimum amout of hours that ensures positive consumption
-                                    hours_min = np.maximum(hours_min,2.0)
-                                    init_h = np.array([hours_min]) if i_a==0 else np.array([sol.h[t,i_n,i_s,i_a-1,i_k]]) # initial guess on optimal hours
-
-                                    res = minimize(obj,init_h,bounds=((0.0,np.inf),),constraints=nlc,method='trust-constr')
-
-                                    # store results
-                                    sol.c[idx] = self.cons_last(res.x[0],assets,capital,kids,spouse)
-                                    sol.h[idx] = res.x[0]
-                                    sol.V[idx] = -res.fun
-
-                                else:
-                                    
-                                    # objective function: negative since we minimize
-                                    obj = lambda x: - self.value_of_choice(x[0],x[1],assets,capital,kids,spouse,t)  
-
-                                    # bounds on consumption 
-                                    lb_c = 0.000001 # avoid dividing with zero
-                                    ub_c = np.inf
-
-                                    # bounds on hours
-                                    lb_h = 0.0
-                                    ub_h = np.inf 
-
-                                    bounds = ((lb_c,ub_c),(lb_h,ub_h))
-                        
-                                    # call optimizer
-                                    init = np.array([lb_c,1.0]) if (i_n == 0 & i_s & i_a==0 & i_k==0) else res.x  # initial guess on optimal consumption and hours
-                                    res = minimize(obj,init,bounds=bounds,method='L-BFGS-B') 
-                                
-                                    # store results
-                                    sol.c[idx] = res.x[0]
-                                    sol.h[idx] = res.x[1]
-                                    sol.V[idx] = -res.fun
-
-    # last period
-    def cons_last(self,hours,assets,capital, kids, spouse):
-        par = self.par
-
-        income_w = self.wage_func(capital,par.T-1) * hours 
-        spouse_income = self.spouse_income_func(spouse, par.T-1)
-        income = income_w + spouse_income 
-        childcare_cost = self.childcare_cost(kids)
-        cons = max(assets + income - childcare_cost, 1e-8)
-        return cons
-
-    def obj_last(self,hours,assets,capital,kids, spouse):
-        cons = self.cons_last(hours,assets,capital,kids,spouse)
-        return - self.util(cons,hours,kids)    
-
-    # earlier periods
-    def value_of_choice(self,cons,hours,assets,capital,kids,spouse,t):
-
-        # a. unpack
-        par = self.par
-        sol = self.sol
-
-        # b. penalty for violating bounds. 
-        penalty = 0.0
-        if cons < 0.0:
-            penalty += cons*1_000.0
-            cons = 1.0e-5
-        if hours < 0.0:
-            penalty += hours*1_000.0
-            hours = 0.0
-
-        # c. utility from consumption
-        util = self.util(cons,hours,kids)
-        
-        # d. *expected* continuation value from savings
-        income_w = self.wage_func(capital,t) * hours 
-        spouse_income = self.spouse_income_func(spouse,t)
-        income = income_w + spouse_income
-        childcare_cost = self.childcare_cost(kids)
-        a_next = (1.0+par.r)*(assets + income - cons - childcare_cost)
-        k_next = capital + hours
-
-        # spouse
-        spouse_next = 1
-        no_spouse_next = 0
-
-        # no birth
-        kids_next = kids
-        V_next = sol.V[t+1,kids_next,spouse_next]
-        V_next_no_birth = interp_2d(par.a_grid,par.k_grid,V_next,a_next,k_next)
-
-        # birth
-        if (kids>=(par.Nn-1)):
-            # cannot have more children
-            V_next_birth = V_next_no_birth
-
-        else:
-            kids_next = kids + 1
-            V_next = sol.V[t+1,kids_next,spouse_next]
-            V_next_birth = interp_2d(par.a_grid,par.k_grid,V_next,a_next,k_next)
-
-            
-        V_next_ns = sol.V[t+1,kids_next,no_spouse_next]
-        V_next_no_spouse = interp_2d(par.a_grid,par.k_grid,V_next_ns,a_next,k_next)
-
-        
-
-        EV_next_spouse = par.p_birth * V_next_birth + (1-par.p_birth)*V_next_no_birth
-        EV_next_no_spouse = V_next_no_spouse
-
-        EV_next = par.p_spouse * EV_next_spouse + (1-par.p_spouse)*EV_next_no_spouse
-
-        # e. return value of choice (including penalty)
-        return util + par.rho*EV_next + penalty
-
-
-    def util(self,c,hours,kids):
-        par = self.par
-
-        beta = par.beta_0 + par.beta_1*kids
-
-        return (c)**(1.0+par.eta) / (1.0+par.eta) - beta*(hours)**(1.0+par.gamma) / (1.0+par.gamma) 
-
-    def wage_func(self,capital,t):
-        # after tax wage rate
-        par = self.par
-
-        return (1.0 - par.tau )* par.w_vec[t] * (1.0 + par.alpha * capital)
-    
-    def spouse_income_func(self, spouse, t):
-        par = self.par
-        if par.spouse_dummy == 0:
-            return 0
-        else:
-            return spouse*(0.1 + 0.01*t)
-        
-    def childcare_cost(self, kids): 
-        par = self.par
-        return par.theta * kids
-
-           
-    ##############
-    # Simulation #
-    def simulate(self):
-
-        # a. unpack
-        par = self.par
-        sol = self.sol
-        sim = self.sim
-
-        # b. loop over individuals and time
-        for i in range(par.simN):
-
-            # i. initialize states
-            sim.n[i,0] = sim.n_init[i]
-            sim.a[i,0] = sim.a_init[i]
-            sim.k[i,0] = sim.k_init[i]
-
-            for t in range(par.simT):
-                spouse = 0 
-                if ((sim.draws_uniform_spouse[i,t] <= par.p_spouse)):
-                    spouse = 1
-                sim.s[i,t] = spouse
-
-                # ii. interpolate optimal consumption and hours
-                idx_sol = (t,sim.n[i,t], sim.s[i,t])
-                sim.c[i,t] = interp_2d(par.a_grid,par.k_grid,sol.c[idx_sol],sim.a[i,t],sim.k[i,t])
-                sim.h[i,t] = interp_2d(par.a_grid,par.k_grid,sol.h[idx_sol],sim.a[i,t],sim.k[i,t])
-
-                # iii. store next-period states
-                if t<par.simT-1:
-                    income_w = self.wage_func(sim.k[i,t],t)*sim.h[i,t]
-                    spouse_income = self.spouse_income_func(sim.s[i,t], t)
-                    income = income_w + spouse_income 
-                    childcare_cost = self.childcare_cost(sim.n[i,t])
-                    
-                    sim.a[i,t+1] = (1+par.r)*(sim.a[i,t] + income - sim.c[i,t] - childcare_cost)
-                    sim.k[i,t+1] = sim.k[i,t] + sim.h[i,t]
-
-                    birth = 0 
-                    if ((sim.draws_uniform[i,t] <= par.p_birth) & (sim.n[i,t]<(par.Nn-1)) & (sim.s[i,t]==1)):
-                        birth = 1
-                    sim.n[i,t+1] = sim.n[i,t] + birth
-                    
-
-
+import os
+import time
+import functools
+import contextlib
+import glob
+import hashlib
+import itertools
+from copy import deepcopy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from collections import namedtuple
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+from scipy.optimize import minimize
+
+import numba
+from numba import njit, prange
+
+from EconModel import EconModelClass, jit
+
+from consav.grids import nonlinspace
+from consav.linear_interp import interp_2d
+from consav.linear_interp_2d import _interp_2d
+from consav import golden_section_search
+from tqdm import tqdm
+
+# parameters that do not affect the solution
+_nonsolution_pars = ('simT','simN','simulate_method','sim_seed','sim_draws','sim_chunk','threads','cache_dir','cache_size','profile')
+
+# solution arrays stored in the cache
+_cached_sol = ('c','h','V','EV','EV_inv','a_limit','a_next_min','feasible','diag_success','diag_nfev','diag_nit','diag_time')
+
+# value of choices extrapolated beyond the natural borrowing limit in inverse utility space (see untransform_V)
+V_infeasible = -1e10
+
+#############
+# Profiling #
+#############
+
+class Timer:
+    """ context manager adding the elapsed time and a call to timings[stage] """
+
+    __slots__ = ('timings','stage','tic')
+
+    def __init__(self,timings,stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.tic = time.perf_counter()
+
+    def __exit__(self,*args):
+        timing = self.timings.setdefault(self.stage,{'time':0.0,'calls':0})
+        timing['time'] += time.perf_counter()-self.tic
+        timing['calls'] += 1
+
+_no_timer = contextlib.nullcontext()
+
+# methods timed when par.profile = 'detailed' and their stage (called inside the scipy objective)
+_detailed_methods = {
+    'util':'utility','marg_util_c':'utility','marg_util_h':'utility',
+    'wage_func':'income','spouse_income_func':'income','childcare_cost':'income',
+    'interp_EV':'interpolation','interp_EV_grad':'interpolation'}
+
+def timed(func,timings,stage):
+    """ wrap func to add its time to timings[stage] (one perf_counter pair per call) """
+
+    timing = timings.setdefault(stage,{'time':0.0,'calls':0})
+
+    @functools.wraps(func)
+    def wrapper(*args,**kwargs):
+        tic = time.perf_counter()
+        result = func(*args,**kwargs)
+        timing['time'] += time.perf_counter()-tic
+        timing['calls'] += 1
+        return result
+
+    return wrapper
+
+def profiled(stage):
+    """ decorator timing a method as stage when par.profile is set (and the methods in _detailed_methods when it is 'detailed') """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(self,*args,**kwargs):
+            if not self.par.profile: return func(self,*args,**kwargs)
+            with self.profiling_detailed(), Timer(self.timings,stage):
+                return func(self,*args,**kwargs)
+        return wrapper
+
+    return decorator
+
+class DynLaborFertModelClass(EconModelClass):
+
+    def settings(self):
+        """ fundamental settings """
+
+        # time-indexed parameters: a change in period t only requires re-solving periods <= t
+        self.time_varying = ['w_vec']
+
+        # parameters of the last solve (used for incremental re-solves)
+        self.solved_pars = None
+
+        self.other_attrs = ['time_varying','solved_pars']
+
+        # time and calls by stage when par.profile is set (times of nested stages are included in the outer stage, e.g. objective in optimizer)
+        self.timings = {}
+
+    def setup(self):
+        """ set baseline parameters """
+
+        # unpack
+        par = self.par
+
+        par.T = 10 # time periods
+        
+        # preferences
+        par.rho = 0.98 # discount factor
+
+        par.beta_0 = 0.1 # weight on labor dis-utility (constant)
+        par.beta_1 = 0.05 # additional weight on labor dis-utility (children)
+        par.eta = -2.0 # CRRA coefficient
+        par.gamma = 2.5 # curvature on labor hours 
+
+        # income
+        par.alpha = 0.1 # human capital accumulation 
+        par.w = 1.0 # wage base level
+        par.tau = 0.1 # labor income tax
+
+        # children
+        par.p_birth = 0.1
+        par.p_spouse = 1.0
+        par.theta = 0.00 # Childcare cost
+
+        # saving
+        par.r = 0.02 # interest rate
+
+        # grids
+        par.a_max = 5.0 # maximum point in wealth grid
+        par.a_min = -10.0 # minimum point in wealth grid
+        par.Na = 50 #70 # number of grid points in wealth grid 
+        
+        par.k_max = 20.0 # maximum point in wealth grid
+        par.Nk = 20 #30 # number of grid points in wealth grid    
+        par.k_reachable = False # True: human capital grid in period t only spans reachable levels, k <= k_init_max + t*h_max (hours are then bounded by h_max in all solvers)
+        par.k_init_max = 0.0 # maximum initial human capital (used when k_reachable)
+
+        par.Nn = 2 # number of children
+        par.spouse_dummy = 0 # 1 if spouse, 0 if not
+        par.Ns = 2 # number of spouse states
+
+        # simulation
+        par.simT = par.T # number of periods
+        par.simN = 1_000 # number of individuals
+        par.simulate_method = 'vectorized' # 'vectorized' or 'loop'
+        par.sim_seed = 9210 # seed for draws
+        par.sim_draws = 'stored' # 'stored' (drawn in allocate) or 'stream' (counter-based, drawn on the fly)
+        par.sim_chunk = 0 # > 0: simulate in chunks of this many individuals without allocating the full panel
+
+        # solver
+        par.solve_method = 'scipy' # 'scipy', 'numba' (parallel over states), 'egm' or 'vfi_grid' (discretized choices), see solve_numba for how they differ from scipy
+        par.h_max = 20.0 # upper bound on hours (numba, egm and vfi_grid solvers, scipy only with k_reachable)
+        par.Nh = 50 # number of grid points in hours choice grid (vfi_grid solver, savings are chosen on the wealth grid)
+        par.vfi_polish = False # True: polish the grid maximum with golden-section searches over hours and consumption (vfi_grid solver)
+        par.tol = 1e-6 # tolerance (numba solver)
+        par.max_iter = 1_000 # maximum number of iterations (numba solver)
+        par.polish_tol = 0.0 # > 0: re-solve from a cold start where the solution moves more than this (relative) from the warm start
+        par.V_transform = False # True: interpolate the expected value in inverse utility space, ((1+eta)*EV)**(1/(1+eta)), on the wealth grid (requires eta < -1)
+        par.threads = numba.config.NUMBA_NUM_THREADS # number of threads (numba solver)
+
+        # cache of solutions
+        par.cache_dir = '' # folder for cached solutions, '' = no caching (only cold solves of all periods are saved)
+        par.cache_size = 1.0 # maximum size of the cache in gb (least recently used solutions are removed)
+
+        # profiling
+        par.profile = False # accumulate time and calls by stage in .timings: False, True or 'detailed' (also utility, income and interpolation inside the scipy objective, slow)
+
+
+    def allocate(self):
+        """ allocate model """
+
+        # unpack
+        par = self.par
+        sol = self.sol
+        sim = self.sim
+
+        par.simT = par.T
+        
+        # a. asset grid
+        par.a_grid = nonlinspace(par.a_min,par.a_max,par.Na,1.1)
+
+        # b. human capital grid and grids by period (period 0 spans at least one period of hours)
+        par.k_grid = nonlinspace(0.0,par.k_max,par.Nk,1.1)
+        par.k_grids = np.zeros((par.T,par.Nk))
+        for t in range(par.T):
+            if par.k_reachable:
+                k_max_t = min(par.k_max,par.k_init_max + max(t,1)*par.h_max)
+                par.k_grids[t] = nonlinspace(0.0,k_max_t,par.Nk,1.1)
+            else:
+                par.k_grids[t] = par.k_grid
+
+        # lookup tables for grid_search (same number of bins in all periods)
+        par.a_grid_lut = grid_lut(par.a_grid)
+        n_bins = max(grid_lut(k_grid).size for k_grid in par.k_grids)
+        par.k_grids_lut = np.array([grid_lut(k_grid,n_bins) for k_grid in par.k_grids])
+
+        # hours choice grid (vfi_grid solver)
+        par.h_grid = nonlinspace(0.0,par.h_max,par.Nh,1.1)
+
+        # c. number of children grid
+        par.n_grid = np.arange(par.Nn)
+
+        # d. Spouse grid
+        par.spouse_grid = np.arange(par.Ns)
+
+        # d. solution arrays
+        shape = (par.T,par.Nn, par.Ns, par.Na,par.Nk)
+        sol.c = np.nan + np.zeros(shape)
+        sol.h = np.nan + np.zeros(shape)
+        sol.V = np.nan + np.zeros(shape)
+        sol.EV = np.nan + np.zeros(shape) # expected value next period, E_t[V_{t+1}], given state in t
+
+        # expected value in inverse utility space (only allocated when interpolated, see compute_EV)
+        if par.V_transform:
+            assert par.eta < -1.0, 'V_transform requires eta < -1 (negative value function)'
+            sol.EV_inv = np.nan + np.zeros(shape)
+        else:
+            sol.EV_inv = np.zeros((0,0,0,0,0))
+
+        # natural borrowing limit by (t,n,s,k), lowest wealth next period by (t,n,k_next) and feasible states (see compute_feasibility)
+        sol.a_limit = np.nan + np.zeros((par.T,par.Nn,par.Ns,par.Nk))
+        sol.a_next_min = np.nan + np.zeros((par.T,par.Nn,par.Nk))
+        sol.feasible = np.ones(shape,dtype=np.bool_)
+
+        # solver diagnostics per grid point
+        sol.diag_success = np.zeros(shape,dtype=np.bool_) # converged
+        sol.diag_nfev = np.zeros(shape,dtype=np.int_) # number of objective evaluations
+        sol.diag_nit = np.zeros(shape,dtype=np.int_) # number of iterations
+        sol.diag_time = np.nan + np.zeros(shape) # seconds (jitted solvers: time of period distributed by nfev)
+
+        # e. simulation arrays (not allocated when simulating in chunks)
+        if par.sim_chunk > 0:
+            assert par.sim_draws == 'stream', 'simulation in chunks requires sim_draws = stream'
+            shape = (0,par.simT)
+        else:
+            shape = (par.simN,par.simT)
+        sim.c = np.nan + np.zeros(shape)
+        sim.h = np.nan + np.zeros(shape)
+        sim.a = np.nan + np.zeros(shape)
+        sim.k = np.nan + np.zeros(shape)
+        sim.n = np.zeros(shape,dtype=np.int_)
+        sim.s = np.zeros(shape,dtype=np.int_)
+
+        # f. draws used to simulate child arrival and spouse
+        if par.sim_draws == 'stored':
+            np.random.seed(par.sim_seed)
+            sim.draws_uniform = np.random.uniform(size=shape)
+            sim.draws_uniform_spouse = np.random.uniform(size=shape)
+        elif par.sim_draws == 'stream': # not stored, see uniform_draw()
+            sim.draws_uniform = np.zeros((0,0))
+            sim.draws_uniform_spouse = np.zeros((0,0))
+        else:
+            raise ValueError(f'unknown sim_draws: {par.sim_draws}')
+
+        # g. initialization (empty arrays mean zeros for everyone)
+        simN_init = 0 if par.sim_chunk > 0 else par.simN
+        sim.a_init = np.zeros(simN_init)
+        sim.k_init = np.zeros(simN_init)
+        sim.n_init = np.zeros(simN_init,dtype=np.int_)
+
+        # h. vector of wages. Used for simulating elasticities
+        par.w_vec = par.w * np.ones(par.T)
+
+        self.solved_pars = None
+
+
+    ###########
+    # Sweeps #
+    def sweep(self,param_grid,moments_fn,workers=1):
+        """ solve and simulate for each point in a parameter grid (warm started from the current solution if complete)
+
+        Args:
+
+            param_grid (dict or list): dict of lists (all combinations are used) or list of dicts
+            moments_fn (callable): moments_fn(model) returns a dict of moments for a solved and simulated model
+            workers (int,optional): number of processes
+
+        Returns:
+
+            df (pandas.DataFrame): one row per point with parameters and moments
+
+        """
+
+        # a. points
+        if isinstance(param_grid,dict):
+            keys = list(param_grid.keys())
+            points = [dict(zip(keys,values)) for values in itertools.product(*param_grid.values())]
+        else:
+            points = list(param_grid)
+
+        # b. serial
+        if workers <= 1:
+            _sweep_init(self,moments_fn,threads=self.par.threads)
+            results = [_sweep_point(point) for point in points]
+
+        # c. process pool
+        else:
+
+            # forked workers inherit the compiled kernels, spawned workers compile once each
+            if 'fork' in multiprocessing.get_all_start_methods():
+                self.compile_kernels()
+                context = multiprocessing.get_context('fork')
+            else:
+                context = multiprocessing.get_context('spawn')
+
+            with ProcessPoolExecutor(max_workers=workers,mp_context=context,initializer=_sweep_init,initargs=(self,moments_fn)) as pool:
+                results = list(pool.map(_sweep_point,points))
+
+        return pd.DataFrame([{**point,**result} for point,result in zip(points,results)])
+
+    def compile_kernels(self):
+        """ compile the jitted solver for the current types without running it """
+
+        par = self.par
+
+        with jit(self) as model:
+
+            types = lambda *args: tuple(numba.typeof(x) for x in args)
+
+            if par.solve_method == 'numba':
+                solve_period_jit.compile(types(0,model.par,model.sol,model.sol.c,model.sol.h,False))
+            elif par.solve_method == 'egm':
+                q = np.zeros((par.Nn,par.Ns,par.Na,par.Nk))
+                compute_q_jit.compile(types(0,model.par,model.sol,q))
+                solve_period_egm_jit.compile(types(0,model.par,model.sol,q))
+            elif par.solve_method == 'vfi_grid':
+                income = np.zeros((par.Ns,par.Nk,par.Nh))
+                disutil = np.zeros((par.Nn,par.Nh))
+                EV_k = np.zeros((par.Nn,par.Ns,par.Nk,par.Nh,par.Na))
+                compute_EV_k_jit.compile(types(0,model.par,model.sol,EV_k))
+                solve_period_vfi_jit.compile(types(0,model.par,model.sol,income,disutil,EV_k))
+
+    def timer(self,stage):
+        """ context manager timing stage when par.profile is True """
+
+        return Timer(self.timings,stage) if self.par.profile else _no_timer
+
+    @contextlib.contextmanager
+    def profiling_detailed(self):
+        """ time the methods in _detailed_methods while active when par.profile is 'detailed' """
+
+        # a. not detailed or already active
+        if not self.par.profile == 'detailed' or any(name in self.__dict__ for name in _detailed_methods):
+            yield
+            return
+
+        # b. shadow methods by timed versions
+        for name,stage in _detailed_methods.items():
+            setattr(self,name,timed(getattr(self,name),self.timings,stage))
+
+        try:
+            yield
+        finally:
+            for name in _detailed_methods: delattr(self,name)
+
+    ############
+    # Solution #
+    @profiled('solve')
+    def solve(self,warm_start=None,incremental=True):
+        """ solve model
+
+        Args:
+
+            warm_start (optional): solution with c and h to start the optimizers from, e.g. the sol of a previous model.
+                None uses the current solution if it is complete and False always starts cold.
+            incremental (bool,optional): if only time-varying parameters have changed since the last solve, 
+                only re-solve the periods up to the last changed period
+
+        """
+
+        # a. unpack
+        par = self.par
+
+        if par.cache_dir and self.load_cached(): return
+
+        t_last = self.get_resolve_period() if incremental else par.T-1
+        guess = self.get_warm_start(warm_start)
+
+        # b. solve
+        self.solved_pars = None
+        self.compute_feasibility()
+
+        if par.solve_method == 'scipy':
+            self.solve_scipy(guess,t_last)
+        elif par.solve_method == 'numba':
+            self.solve_numba(guess,t_last)
+        elif par.solve_method == 'egm':
+            self.solve_egm(guess,t_last)
+        elif par.solve_method == 'vfi_grid':
+            self.solve_vfi_grid(guess,t_last)
+        else:
+            raise ValueError(f'unknown solve_method: {par.solve_method}')
+
+        self.solved_pars = self.get_solution_pars()
+
+        # only cold solves of all periods are cached (warm and incremental solves depend on the previous solution)
+        if par.cache_dir and guess is None and t_last == par.T-1: self.save_cached()
+
+    def get_solution_pars(self):
+        """ copy of the parameters that affect the solution """
+
+        return {key:deepcopy(value) for key,value in self.par.__dict__.items() if not key in _nonsolution_pars}
+
+    def get_resolve_period(self):
+        """ last period that must be (re-)solved given the parameters of the last solve, -1 if none """
+
+        par = self.par
+
+        # a. no (complete) previous solve
+        if self.solved_pars is None: return par.T-1
+
+        # b. compare parameters
+        pars = self.get_solution_pars()
+        if not pars.keys() == self.solved_pars.keys(): return par.T-1
+
+        t_last = -1
+        for key,value in pars.items():
+
+            value_prev = self.solved_pars[key]
+
+            if key in self.time_varying:
+                if not np.shape(value) == np.shape(value_prev): return par.T-1
+                changed = np.flatnonzero(np.asarray(value) != np.asarray(value_prev))
+                if changed.size > 0: t_last = max(t_last,int(changed[-1]))
+            elif isinstance(value,np.ndarray):
+                if not (value.shape == value_prev.shape and np.array_equal(value,value_prev)): return par.T-1
+            elif not value == value_prev:
+                return par.T-1
+
+        return min(t_last,par.T-1)
+
+    def cache_key(self):
+        """ hash of the parameters that affect the solution """
+
+        h = hashlib.sha256()
+        for key,value in sorted(self.get_solution_pars().items()):
+            h.update(key.encode())
+            if isinstance(value,np.ndarray):
+                h.update(f'{value.dtype.str}{value.shape}'.encode())
+                h.update(np.ascontiguousarray(value).tobytes())
+            else:
+                if isinstance(value,np.generic): value = value.item()
+                h.update(repr(value).encode())
+
+        return h.hexdigest()
+
+    def load_cached(self):
+        """ load solution from the cache, returns False if not cached """
+
+        par = self.par
+        sol = self.sol
+
+        filename = os.path.join(par.cache_dir,f'{self.cache_key()}.npz')
+        if not os.path.exists(filename): return False
+
+        with np.load(filename) as data:
+            if not all(key in data for key in _cached_sol): return False
+            for key in _cached_sol:
+                getattr(sol,key)[...] = data[key]
+
+        os.utime(filename) # mark as recently used
+        self.solved_pars = self.get_solution_pars()
+
+        return True
+
+    def save_cached(self):
+        """ save solution to the cache and remove the least recently used solutions if it is too large """
+
+        par = self.par
+        sol = self.sol
+
+        # a. save (write and rename so concurrent processes never see partial files)
+        os.makedirs(par.cache_dir,exist_ok=True)
+        filename = os.path.join(par.cache_dir,f'{self.cache_key()}.npz')
+        filename_tmp = f'{filename}.{os.getpid()}.tmp.npz'
+        np.savez_compressed(filename_tmp,**{key:getattr(sol,key) for key in _cached_sol})
+        os.replace(filename_tmp,filename)
+
+        # b. evict least recently used
+        files = sorted(glob.glob(os.path.join(par.cache_dir,'*[0-9a-f].npz')),key=os.path.getmtime)
+        sizes = [os.path.getsize(file) for file in files]
+        total = sum(sizes)
+        for file,size in zip(files[:-1],sizes[:-1]):
+            if total <= par.cache_size*10**9: break
+            try:
+                os.remove(file)
+            except FileNotFoundError: # removed by another process
+                pass
+            total -= size
+
+    def solve_scipy(self,guess=None,t_last=None):
+        """ solve model with scipy optimizers """
+
+        # a. unpack
+        par = self.par
+        sol = self.sol
+
+        if t_last is None: t_last = par.T-1
+
+        # b. loop backwards (over all periods up to t_last)
+        for t in tqdm(reversed(range(t_last+1))):
+
+            # i. last period: hours from the first-order condition
+            if t == par.T-1:
+                self.solve_last_period(guess)
+                continue
+
+            # ii. expected value next period
+            self.compute_EV(t)
+            x_prev = None
+
+            # iii. loop over state variables: number of children, human capital and wealth in beginning of period
+            for i_n,kids in enumerate(par.n_grid):
+                for i_a,assets in enumerate(par.a_grid):
+                    for i_k,capital in enumerate(par.k_grids[t]):
+                            for i_s,spouse in enumerate(par.spouse_grid):
+                                idx = (t,i_n,i_s,i_a,i_k)
+
+                                # skip states below the natural borrowing limit
+                                if not sol.feasible[idx]:
+                                    sol.c[idx],sol.h[idx],sol.V[idx] = 1e-6,par.h_max,np.nan
+                                    sol.diag_success[idx],sol.diag_nfev[idx],sol.diag_nit[idx],sol.diag_time[idx] = True,0,0,0.0
+                                    continue
+
+                                # iv. find optimal consumption and hours at this level of wealth in this period t.
+                                    
+                                # objective function: negative since we minimize
+                                obj = lambda x: - self.value_of_choice(x[0],x[1],assets,capital,kids,spouse,t)  
+                                jac = lambda x: - self.value_of_choice_grad(x[0],x[1],assets,capital,kids,spouse,t)
+                                if par.profile: # optimizer overhead is optimizer - objective
+                                    obj,jac = timed(obj,self.timings,'objective'),timed(jac,self.timings,'objective')
+
+                                # bounds on consumption 
+                                lb_c = 0.000001 # avoid dividing with zero
+                                ub_c = np.inf
+
+                                # bounds on hours (reachable human capital grids assume at most h_max hours)
+                                lb_h = 0.0
+                                ub_h = par.h_max if par.k_reachable else np.inf
+
+                                bounds = ((lb_c,ub_c),(lb_h,ub_h))
+                    
+                                # call optimizer
+                                if guess is not None:
+                                    init = np.array([guess[0][idx],guess[1][idx]])
+                                else:
+                                    init = np.array([lb_c,1.0]) if (i_n == 0 & i_s & i_a==0 & i_k==0) else res.x  # initial guess on optimal consumption and hours
+                                init = np.clip(init,(lb_c,lb_h),(ub_c,ub_h))
+                                tic = time.perf_counter()
+                                with self.timer('optimizer'):
+                                    res = minimize(obj,init,jac=jac,bounds=bounds,method='L-BFGS-B') 
+                                nfev,nit = res.nfev,res.nit
+
+                                # polish: re-solve from a cold start if the solution moved far from the warm start (or failed)
+                                moved = np.max(np.abs(res.x-init)/(1.0+np.abs(init)))
+                                if guess is not None and par.polish_tol > 0 and not (moved <= par.polish_tol and np.isfinite(res.fun)):
+                                    init_cold = np.clip(np.array([lb_c,1.0]) if x_prev is None else x_prev,(lb_c,lb_h),(ub_c,ub_h))
+                                    with self.timer('optimizer'):
+                                        res_cold = minimize(obj,init_cold,jac=jac,bounds=bounds,method='L-BFGS-B')
+                                    nfev,nit = nfev+res_cold.nfev,nit+res_cold.nit
+                                    if not res.fun <= res_cold.fun: res = res_cold
+
+                                toc = time.perf_counter()
+                                x_prev = res.x
+                            
+                                # store results
+                                sol.c[idx] = res.x[0]
+                                sol.h[idx] = res.x[1]
+                                sol.V[idx] = -res.fun
+
+                                sol.diag_success[idx] = res.success
+                                sol.diag_nfev[idx] = nfev
+                                sol.diag_nit[idx] = nit
+                                sol.diag_time[idx] = toc-tic
+
+    def solve_multigrid(self,levels=2,factor=2):
+        """ solve on successively finer (a,k) grids, each warm started from the policies of the previous grid
+
+        Args:
+
+            levels (int,optional): number of grids (including the final par.Na x par.Nk grid)
+            factor (int,optional): ratio of the number of grid points between consecutive grids
+
+        Combine with par.polish_tol > 0 to re-solve the points where the final policies move far from the coarse ones.
+        The egm and vfi_grid solvers only use the warm start in the last period, so they are solved directly on the final grid.
+
+        """
+
+        par = self.par
+
+        if par.solve_method in ('egm','vfi_grid'):
+            self.solve(warm_start=False,incremental=False)
+            return
+
+        model_prev = None
+        for level in reversed(range(levels)):
+
+            # a. model on this level's grid
+            if level == 0:
+                model = self
+            else:
+                model = self.copy()
+                model.par.Na = max(int(np.ceil(par.Na/factor**level)),4)
+                model.par.Nk = max(int(np.ceil(par.Nk/factor**level)),4)
+                model.par.simN = 0 # not simulated
+                model.allocate()
+                for key in self.time_varying: setattr(model.par,key,deepcopy(getattr(par,key)))
+
+            # b. solve warm started from the previous level
+            if model_prev is None:
+                warm_start = False
+            else:
+                warm_start = model_prev.interp_policy(model.par.a_grid,model.par.k_grids)
+                model.clip_policy(warm_start)
+
+            model.solve(warm_start=warm_start,incremental=False)
+            model_prev = model
+
+    def interp_policy(self,a_grid,k_grids):
+        """ consumption and hours policies interpolated onto other wealth and human capital grids (by period) """
+
+        par = self.par
+        sol = self.sol
+
+        shape = (par.T,par.Nn,par.Ns,a_grid.size,k_grids.shape[1])
+        policy = SimpleNamespace(c=np.zeros(shape),h=np.zeros(shape))
+        
+        for t in range(par.T):
+
+            a,k = np.meshgrid(a_grid,k_grids[t],indexing='ij')
+            a = a.ravel()
+            k = k.ravel()
+
+            for i_n in range(par.Nn):
+                for i_s in range(par.Ns):
+                    values = (sol.c[t,i_n,i_s],sol.h[t,i_n,i_s])
+                    interp_2d_multi_batch_vec(par.a_grid,par.a_grid_lut,par.k_grids[t],par.k_grids_lut[t],values,a,k,(policy.c[t,i_n,i_s].ravel(),policy.h[t,i_n,i_s].ravel()))
+
+        return policy
+
+    def clip_policy(self,policy):
+        """ clip consumption and hours policies (in place) to the bounds used in the numba solver """
+
+        par = self.par
+
+        for t in range(par.T):
+            kids,spouse,assets,capital = np.meshgrid(par.n_grid,par.spouse_grid,par.a_grid,par.k_grids[t],indexing='ij')
+            income_max = self.wage_func(capital,t)*par.h_max + self.spouse_income_func(spouse,t)
+            ub_c = assets + income_max - self.childcare_cost(kids) - par.a_grid[0]/(1.0+par.r)
+            policy.c[t] = np.clip(policy.c[t],1e-6,np.fmax(ub_c,1e-6))
+            policy.h[t] = np.clip(policy.h[t],0.0,par.h_max)
+
+    def get_warm_start(self,warm_start=None):
+        """ copy of (c,h) to warm start the solver from, None for a cold start """
+
+        if warm_start is False: return None
+
+        sol_prev = self.sol if warm_start is None else warm_start
+        
+        if not sol_prev.c.shape == self.sol.c.shape:
+            if warm_start is None: return None
+            raise ValueError(f'warm_start has shape {sol_prev.c.shape}, expected {self.sol.c.shape}')
+
+        # not (fully) solved
+        if not (np.all(np.isfinite(sol_prev.c)) and np.all(np.isfinite(sol_prev.h))): return None
+
+        return sol_prev.c.copy(),sol_prev.h.copy()
+
+    def solve_numba(self,guess=None,t_last=None):
+        """ solve model with jitted optimizers
+        
+        Unlike the scipy solver, the jitted solvers (numba, egm and vfi_grid) bound hours by 
+        par.h_max and savings by the natural borrowing limit, so wealth next period is never 
+        below sol.a_next_min (at least the bottom of the wealth grid, see compute_feasibility). 
+        The scipy solver may borrow below the grid, where the expected value is extrapolated. 
+        The jitted values are therefore lower near the bottom of the wealth grid. With the 
+        default grids (Na = 50, Nk = 20, T = 10), V from numba in t = 0 is at most 0.070 below 
+        scipy (a = -10, k = 20: c = 4.0 against 6.2), and 7.7 percent of the states are more 
+        than 1e-4 below. Where numba finds a better local optimum, it is at most 0.015 above. 
+        egm matches numba (0.069 below). vfi_grid also has discretization error: it is at most 
+        0.10 below and 0.11 above scipy in t = 0 without par.vfi_polish.
+
+        """
+
+        numba.set_num_threads(self.par.threads)
+        if t_last is None: t_last = self.par.T-1
+
+        with jit(self) as model:
+
+            par = model.par
+            sol = model.sol
+
+            warm = guess is not None
+            c0,h0 = guess if warm else (sol.c,sol.h)
+
+            for t in tqdm(reversed(range(t_last+1))):
+                if t == par.T-1:
+                    self.solve_last_period(guess)
+                else:
+                    self.compute_EV(t)
+                    tic = time.perf_counter()
+                    with self.timer('optimizer'):
+                        solve_period_jit(t,par,sol,c0,h0,warm)
+                    self.distribute_time(t,time.perf_counter()-tic)
+
+    def solve_egm(self,guess=None,t_last=None):
+        """ solve model with EGM for consumption given hours and golden-section search over hours 
+        
+        the warm start is only used in the last period as EGM does not need an initial guess
+        
+        """
+
+        numba.set_num_threads(self.par.threads)
+        if t_last is None: t_last = self.par.T-1
+
+        # a. marginal value of end-of-period wealth (built once per period)
+        q = np.zeros((self.par.Nn,self.par.Ns,self.par.Na,self.par.Nk))
+
+        with jit(self) as model:
+
+            par = model.par
+            sol = model.sol
+
+            # b. loop backwards
+            for t in tqdm(reversed(range(t_last+1))):
+                if t == par.T-1:
+                    self.solve_last_period(guess)
+                else:
+                    self.compute_EV(t)
+                    tic = time.perf_counter()
+                    with self.timer('expectation'):
+                        compute_q_jit(t,par,sol,q)
+                    with self.timer('optimizer'):
+                        solve_period_egm_jit(t,par,sol,q)
+                    self.distribute_time(t,time.perf_counter()-tic)
+
+    def solve_vfi_grid(self,guess=None,t_last=None):
+        """ solve model by maximizing over a grid of hours and savings (next-period wealth on the wealth grid)
+
+        Per period, utility of hours, income and the expected value (interpolated in human capital 
+        for each hours choice) are tabulated for all choices, so each state is a maximum over a 
+        dense array. With par.vfi_polish the maximum is refined by golden-section searches.
+        The warm start is only used in the last period.
+
+        """
+
+        numba.set_num_threads(self.par.threads)
+        if t_last is None: t_last = self.par.T-1
+
+        par = self.par
+
+        # a. tables for all choices
+        income = np.zeros((par.Ns,par.Nk,par.Nh)) # income by spouse, human capital and hours
+        disutil = np.zeros((par.Nn,par.Nh)) # disutility of hours by kids and hours
+        EV_k = np.zeros((par.Nn,par.Ns,par.Nk,par.Nh,par.Na)) # expected value by state, hours and savings
+
+        for i_n,kids in enumerate(par.n_grid):
+            beta = par.beta_0 + par.beta_1*kids
+            disutil[i_n] = beta*par.h_grid**(1.0+par.gamma) / (1.0+par.gamma)
+
+        with jit(self) as model:
+
+            par = model.par
+            sol = model.sol
+
+            # b. loop backwards
+            for t in tqdm(reversed(range(t_last+1))):
+                if t == par.T-1:
+                    self.solve_last_period(guess)
+                else:
+                    self.compute_EV(t)
+                    tic = time.perf_counter()
+                    with self.timer('expectation'):
+                        compute_EV_k_jit(t,par,sol,EV_k)
+                    with self.timer('income'):
+                        for i_s,spouse in enumerate(par.spouse_grid):
+                            wage = self.wage_func(par.k_grids[t],t)
+                            income[i_s] = wage[:,None]*par.h_grid[None,:] + self.spouse_income_func(spouse,t)
+                    with self.timer('optimizer'):
+                        solve_period_vfi_jit(t,par,sol,income,disutil,EV_k)
+                    self.distribute_time(t,time.perf_counter()-tic)
+
+    def distribute_time(self,t,seconds):
+        """ distribute the time of solving period t over grid points by number of objective evaluations """
+
+        nfev = self.sol.diag_nfev[t]
+        self.sol.diag_time[t] = seconds*nfev/max(nfev.sum(),1)
+
+    def diagnostics(self,by=('t','n','s')):
+        """ summary of solver diagnostics
+
+        Args:
+
+            by (tuple): group by subset of 't','n','s','i_a','i_k'
+
+        Returns:
+
+            df (pandas.DataFrame): number of points, infeasible share, failure rate, evaluations, iterations and time by group
+
+        """
+
+        par = self.par
+        sol = self.sol
+
+        t,n,s,i_a,i_k = np.meshgrid(np.arange(par.T),par.n_grid,par.spouse_grid,np.arange(par.Na),np.arange(par.Nk),indexing='ij')
+
+        df = pd.DataFrame({
+            't':t.ravel(),'n':n.ravel(),'s':s.ravel(),'i_a':i_a.ravel(),'i_k':i_k.ravel(),
+            'infeasible':~sol.feasible.ravel(),'failed':~sol.diag_success.ravel(),'nfev':sol.diag_nfev.ravel(),'nit':sol.diag_nit.ravel(),'time':sol.diag_time.ravel()})
+
+        return df.groupby(list(by)).agg(
+            points=('failed','size'),infeasible=('infeasible','mean'),fail_rate=('failed','mean'),
+            nfev_mean=('nfev','mean'),nfev_max=('nfev','max'),nit_mean=('nit','mean'),time=('time','sum'))
+
+    def compute_feasibility(self):
+        """ natural borrowing limit and feasible states
+
+        The limit is the lowest wealth at which consumption can be positive in all 
+        future states (reached with positive probability) when working h_max hours 
+        and respecting the borrowing limit at the bottom of the wealth grid. Hours 
+        are unbounded in the last period, so there is no limit there. States at 
+        or below it are infeasible: they are not solved, have value nan 
+        and consumption and hours at the limit (c = 1e-6 and h = h_max).
+
+        sol.a_next_min[t,n] is the lowest wealth next period given kids in t on the 
+        human capital grid of t+1: the limit of the worst next-period state or the 
+        bottom of the wealth grid. The jitted solvers bound choices by it, and the 
+        expected value is extrapolated from feasible states below it (see compute_EV).
+
+        The scipy solver imposes no borrowing limit, so all states are feasible.
+
+        """
+
+        par = self.par
+        sol = self.sol
+
+        if par.solve_method == 'scipy':
+            sol.a_limit[...] = -np.inf
+            sol.a_next_min[...] = -np.inf
+            sol.feasible[...] = True
+            return
+
+        # a. worst-case limit next period given kids today (next-period states as in compute_EV)
+        def worst_next(L_next,i_n):
+            i_n_birth = min(i_n+1,par.Nn-1)
+            candidates = []
+            if par.p_spouse*(1-par.p_birth) > 0: candidates.append(L_next[i_n,1])
+            if par.p_spouse*par.p_birth > 0: candidates.append(L_next[i_n_birth,1])
+            if par.p_spouse < 1: candidates.append(L_next[i_n_birth,0])
+            return np.max(candidates,axis=0)
+
+        # b. limits along the path with h_max hours in all periods from t0 (no limit in the last period, where hours are unbounded)
+        for t0 in range(par.T):
+            
+            L_next = -np.inf*np.ones((par.Nn,par.Ns,par.Nk))
+            for t in reversed(range(t0,par.T-1)):
+
+                capital = par.k_grids[t0] + (t-t0)*par.h_max
+                L = np.zeros((par.Nn,par.Ns,par.Nk))
+                for i_n,kids in enumerate(par.n_grid):
+                    for i_s,spouse in enumerate(par.spouse_grid):
+                        income_max = self.wage_func(capital,t)*par.h_max + self.spouse_income_func(spouse,t)
+                        a_next_min = np.fmax(worst_next(L_next,i_n),par.a_grid[0])
+                        L[i_n,i_s] = self.childcare_cost(kids) - income_max + a_next_min/(1.0+par.r)
+
+                L_next = L
+
+            sol.a_limit[t0] = L_next
+
+        # c. lowest wealth next period (nothing after the last period)
+        sol.a_next_min[par.T-1] = par.a_grid[0]
+        for t in range(par.T-1):
+            for i_n in range(par.Nn):
+                sol.a_next_min[t,i_n] = np.fmax(worst_next(sol.a_limit[t+1],i_n),par.a_grid[0])
+
+        # d. feasible states
+        sol.feasible[...] = par.a_grid[:,None] > sol.a_limit[:,:,:,None,:]
+
+    def sim_feasible(self):
+        """ mask of simulated observations above the natural borrowing limit (False should be ignored) """
+
+        par = self.par
+        sol = self.sol
+        sim = self.sim
+
+        feasible = np.ones(sim.a.shape,dtype=np.bool_)
+        for t in range(min(par.simT,par.T)):
+            for i_n in range(par.Nn):
+                for i_s in range(par.Ns):
+
+                    I = (sim.n[:,t] == i_n) & (sim.s[:,t] == i_s)
+                    if not np.any(I): continue
+
+                    a_limit = np.interp(sim.k[I,t],par.k_grids[t],sol.a_limit[t,i_n,i_s])
+                    feasible[I,t] = sim.a[I,t] > a_limit
+
+        return feasible
+
+    @profiled('expectation')
+    def compute_EV(self,t):
+        """ expected value next period on the grid, E_t[V_{t+1}] given (n,s) in t 
+        
+        Where a next-period state reached with positive probability is infeasible, the expected value 
+        is extrapolated linearly from the feasible states (in wealth, and in human capital 
+        if no wealth level is feasible).
+
+        """
+
+        par = self.par
+        sol = self.sol
+
+        for i_n,kids in enumerate(par.n_grid):
+
+            # no birth
+            kids_next = kids
+            V_next_no_birth = sol.V[t+1,kids_next,1]
+
+            # birth
+            if kids >= par.Nn-1:
+                V_next_birth = V_next_no_birth
+            else:
+                kids_next = kids + 1
+                V_next_birth = sol.V[t+1,kids_next,1]
+
+            # no spouse
+            V_next_no_spouse = sol.V[t+1,kids_next,0]
+
+            # expectation over states reached with positive probability (infeasible states are nan)
+            EV_next = np.zeros((par.Na,par.Nk))
+            for prob,V_next in ((par.p_spouse*par.p_birth,V_next_birth),(par.p_spouse*(1-par.p_birth),V_next_no_birth),(1-par.p_spouse,V_next_no_spouse)):
+                if prob > 0: EV_next += prob*V_next
+
+            fill_nan_linear(par.a_grid,EV_next)
+            fill_nan_linear(par.k_grids[t+1],EV_next.T)
+
+            # same expectation for all spouse states today
+            sol.EV[t,i_n,:] = EV_next
+            if par.V_transform: sol.EV_inv[t,i_n,:] = self.transform_V(EV_next)
+
+    # last period
+    @profiled('last period')
+    def solve_last_period(self,guess=None):
+        """ solve last period for all states at once with a safeguarded Newton method on the FOC for hours """
+
+        par = self.par
+        sol = self.sol
+        t = par.T-1
+
+        # a. states
+        kids,spouse,assets,capital = np.meshgrid(par.n_grid,par.spouse_grid,par.a_grid,par.k_grids[t],indexing='ij')
+        wage = self.wage_func(capital,t)
+        income_other = assets + self.spouse_income_func(spouse,t) - self.childcare_cost(kids)
+
+        # b. FOC: wage*u_c(c) + u_h(h) = 0 with c = income_other + wage*h, decreasing in h
+        def foc(hours):
+            cons = income_other + wage*hours
+            return wage*self.marg_util_c(cons) + self.marg_util_h(hours,kids)
+
+        def foc_deriv(hours):
+            cons = income_other + wage*hours
+            beta = par.beta_0 + par.beta_1*kids
+            return par.eta*wage**2*cons**(par.eta-1.0) - par.gamma*beta*hours**(par.gamma-1.0)
+
+        tic = time.perf_counter()
+
+        # c. bracket: consumption is positive above hours_min, and the FOC is positive just above it
+        hours_min = np.maximum(-income_other/wage,0.0)
+        lo = hours_min.copy()
+        hi = hours_min + 1.0
+        I = foc(hi) > 0.0
+        nfev = np.ones(hours_min.shape,dtype=np.int_)
+        while np.any(I):
+            lo[I] = hi[I]
+            hi[I] = 2.0*hi[I]
+            I = foc(hi) > 0.0
+            nfev += 1
+
+        # d. safeguarded Newton: fall back on bisection when the step leaves the bracket
+        hours = 0.5*(lo+hi)
+        if guess is not None:
+            h0 = guess[1][t]
+            inside = (h0 > lo) & (h0 < hi)
+            hours[inside] = h0[inside]
+        nit = np.zeros(hours.shape,dtype=np.int_)
+        done = np.zeros(hours.shape,dtype=np.bool_)
+        for _ in range(par.max_iter):
+
+            nit[~done] += 1
+            f = foc(hours)
+            lo = np.where(f > 0.0,hours,lo)
+            hi = np.where(f > 0.0,hi,hours)
+
+            with np.errstate(divide='ignore',invalid='ignore'):
+                hours_new = hours - f/foc_deriv(hours)
+            outside = ~((hours_new > lo) & (hours_new < hi))
+            hours_new[outside] = 0.5*(lo[outside]+hi[outside])
+
+            converged = np.abs(hours_new-hours) < par.tol
+            done |= converged
+            hours = hours_new
+            if np.all(converged): break
+
+        # e. store results
+        cons = income_other + wage*hours
+        sol.c[t] = cons
+        sol.h[t] = hours
+        sol.V[t] = self.util(cons,hours,kids)
+
+        sol.diag_success[t] = converged
+        sol.diag_nfev[t] = nfev + nit
+        sol.diag_nit[t] = nit
+
+        # f. states below the natural borrowing limit
+        I = ~sol.feasible[t]
+        sol.c[t][I] = 1e-6
+        sol.h[t][I] = par.h_max
+        sol.V[t][I] = np.nan
+        sol.diag_success[t][I] = True
+        self.distribute_time(t,time.perf_counter()-tic)
+
+    # earlier periods
+    def value_of_choice(self,cons,hours,assets,capital,kids,spouse,t):
+
+        # a. unpack
+        par = self.par
+        sol = self.sol
+
+        # b. penalty for violating bounds. 
+        penalty = 0.0
+        if cons < 0.0:
+            penalty += cons*1_000.0
+            cons = 1.0e-5
+        if hours < 0.0:
+            penalty += hours*1_000.0
+            hours = 0.0
+
+        # c. utility from consumption
+        util = self.util(cons,hours,kids)
+        
+        # d. *expected* continuation value from savings
+        income_w = self.wage_func(capital,t) * hours 
+        spouse_income = self.spouse_income_func(spouse,t)
+        income = income_w + spouse_income
+        childcare_cost = self.childcare_cost(kids)
+        a_next = (1.0+par.r)*(assets + income - cons - childcare_cost)
+        k_next = capital + hours
+
+        # expectation over birth and spouse is precomputed in sol.EV (see compute_EV)
+        EV_next = self.interp_EV(a_next,k_next,kids,spouse,t)
+
+        # e. return value of choice (including penalty)
+        return util + par.rho*EV_next + penalty
+
+    def value_of_choice_grad(self,cons,hours,assets,capital,kids,spouse,t):
+        """ gradient of value_of_choice wrt. (cons,hours) """
+
+        # a. unpack
+        par = self.par
+        sol = self.sol
+
+        # b. penalty for violating bounds (choice is then fixed at the bound)
+        grad = np.zeros(2)
+        dcons = 1.0
+        dhours = 1.0
+        if cons < 0.0:
+            grad[0] += 1_000.0
+            cons = 1.0e-5
+            dcons = 0.0
+        if hours < 0.0:
+            grad[1] += 1_000.0
+            hours = 0.0
+            dhours = 0.0
+
+        # c. next-period states
+        wage = self.wage_func(capital,t)
+        income = wage*hours + self.spouse_income_func(spouse,t)
+        childcare_cost = self.childcare_cost(kids)
+        a_next = (1.0+par.r)*(assets + income - cons - childcare_cost)
+        k_next = capital + hours
+
+        # d. slopes of the interpolated expected value
+        dEV_da,dEV_dk = self.interp_EV_grad(a_next,k_next,kids,spouse,t)
+
+        # e. gradient
+        grad[0] += dcons*(self.marg_util_c(cons) - par.rho*(1.0+par.r)*dEV_da)
+        grad[1] += dhours*(self.marg_util_h(hours,kids) + par.rho*((1.0+par.r)*wage*dEV_da + dEV_dk))
+
+        return grad
+
+    def interp_EV(self,a_next,k_next,kids,spouse,t):
+        """ expected value next period interpolated at (a_next,k_next) """
+
+        par = self.par
+        sol = self.sol
+
+        if par.V_transform and a_next >= par.a_grid[0]: # extrapolated in levels below the grid
+            return self.untransform_V(interp_2d_lut(par.a_grid,par.a_grid_lut,par.k_grids[t+1],par.k_grids_lut[t+1],sol.EV_inv[t,kids,spouse],a_next,k_next))
+        else:
+            return interp_2d_lut(par.a_grid,par.a_grid_lut,par.k_grids[t+1],par.k_grids_lut[t+1],sol.EV[t,kids,spouse],a_next,k_next)
+
+    def interp_EV_grad(self,a_next,k_next,kids,spouse,t):
+        """ slopes of the interpolated expected value wrt. a_next and k_next """
+
+        par = self.par
+        sol = self.sol
+
+        if par.V_transform and a_next >= par.a_grid[0]: # chain rule through the inverse transform
+            EV_inv,dEV_inv_da,dEV_inv_dk = interp_2d_grad(par.a_grid,par.a_grid_lut,par.k_grids[t+1],par.k_grids_lut[t+1],sol.EV_inv[t,kids,spouse],a_next,k_next)
+            dEV_dEV_inv = EV_inv**par.eta if EV_inv > 0.0 else 0.0
+            return dEV_dEV_inv*dEV_inv_da,dEV_dEV_inv*dEV_inv_dk
+        else:
+            _,dEV_da,dEV_dk = interp_2d_grad(par.a_grid,par.a_grid_lut,par.k_grids[t+1],par.k_grids_lut[t+1],sol.EV[t,kids,spouse],a_next,k_next)
+            return dEV_da,dEV_dk
+
+
+    def util(self,c,hours,kids):
+        par = self.par
+
+        beta = par.beta_0 + par.beta_1*kids
+
+        return (c)**(1.0+par.eta) / (1.0+par.eta) - beta*(hours)**(1.0+par.gamma) / (1.0+par.gamma) 
+
+    def transform_V(self,V):
+        # inverse utility of consumption, linear in consumption
+        par = self.par
+
+        return ((1.0+par.eta)*V)**(1.0/(1.0+par.eta))
+
+    def untransform_V(self,V_inv):
+        par = self.par
+
+        if V_inv <= 0.0: return V_infeasible # extrapolated beyond the borrowing limit
+        return V_inv**(1.0+par.eta) / (1.0+par.eta)
+
+    def marg_util_c(self,c):
+        par = self.par
+
+        return c**par.eta
+
+    def marg_util_h(self,hours,kids):
+        par = self.par
+
+        beta = par.beta_0 + par.beta_1*kids
+
+        return - beta*hours**par.gamma
+
+    def wage_func(self,capital,t):
+        # after tax wage rate
+        par = self.par
+
+        return (1.0 - par.tau )* par.w_vec[t] * (1.0 + par.alpha * capital)
+    
+    def spouse_income_func(self, spouse, t):
+        par = self.par
+        if par.spouse_dummy == 0:
+            return 0
+        else:
+            return spouse*(0.1 + 0.01*t)
+        
+    def childcare_cost(self, kids): 
+        par = self.par
+        return par.theta * kids
+
+           
+    ##############
+    # Simulation #
+    @profiled('simulation')
+    def simulate(self,parallel=False):
+
+        # a. unpack
+        par = self.par
+        sol = self.sol
+        sim = self.sim
+
+        if par.sim_chunk > 0:
+            self.simulate_chunks(materialize=True)
+            return
+        elif parallel:
+            self.simulate_numba()
+            return
+        elif par.simulate_method == 'loop':
+            self.simulate_loop()
+            return
+        elif not par.simulate_method == 'vectorized':
+            raise ValueError(f'unknown simulate_method: {par.simulate_method}')
+
+        # b. initialize states
+        sim.n[:,0] = sim.n_init
+        sim.a[:,0] = sim.a_init
+        sim.k[:,0] = sim.k_init
+
+        # c. advance all individuals one period at a time
+        for t in range(par.simT):
+
+            draws_uniform,draws_uniform_spouse = self.get_draws(t)
+
+            # i. spouse
+            sim.s[:,t] = draws_uniform_spouse <= par.p_spouse
+
+            # ii. interpolate optimal consumption and hours, grouped by solution slice
+            with self.timer('interpolation'):
+                for i_n in range(par.Nn):
+                    for i_s in range(par.Ns):
+
+                        I = (sim.n[:,t] == i_n) & (sim.s[:,t] == i_s)
+                        if not np.any(I): continue
+
+                        a = sim.a[I,t]
+                        k = sim.k[I,t]
+                        c = np.empty(a.size)
+                        h = np.empty(a.size)
+                        interp_2d_multi_batch_vec(par.a_grid,par.a_grid_lut,par.k_grids[t],par.k_grids_lut[t],(sol.c[t,i_n,i_s],sol.h[t,i_n,i_s]),a,k,(c,h))
+                        sim.c[I,t] = c
+                        sim.h[I,t] = h
+
+            # iii. store next-period states
+            with self.timer('transition'):
+                if t < par.simT-1:
+                    income_w = self.wage_func(sim.k[:,t],t)*sim.h[:,t]
+                    spouse_income = self.spouse_income_func(sim.s[:,t],t)
+                    income = income_w + spouse_income
+                    childcare_cost = self.childcare_cost(sim.n[:,t])
+
+                    sim.a[:,t+1] = (1+par.r)*(sim.a[:,t] + income - sim.c[:,t] - childcare_cost)
+                    sim.k[:,t+1] = sim.k[:,t] + sim.h[:,t]
+
+                    birth = (draws_uniform <= par.p_birth) & (sim.n[:,t] < (par.Nn-1)) & (sim.s[:,t] == 1)
+                    sim.n[:,t+1] = sim.n[:,t] + birth
+
+    def simulate_loop(self):
+        """ simulate individual by individual """
+
+        # a. unpack
+        par = self.par
+        sol = self.sol
+        sim = self.sim
+
+        # b. loop over individuals and time
+        for i in range(par.simN):
+
+            # i. initialize states
+            sim.n[i,0] = sim.n_init[i]
+            sim.a[i,0] = sim.a_init[i]
+            sim.k[i,0] = sim.k_init[i]
+
+            for t in range(par.simT):
+                if par.sim_draws == 'stream':
+                    draw_uniform = uniform_draw(par.sim_seed,0,i,t)
+                    draw_uniform_spouse = uniform_draw(par.sim_seed,1,i,t)
+                else:
+                    draw_uniform = sim.draws_uniform[i,t]
+                    draw_uniform_spouse = sim.draws_uniform_spouse[i,t]
+
+                spouse = 0 
+                if ((draw_uniform_spouse <= par.p_spouse)):
+                    spouse = 1
+                sim.s[i,t] = spouse
+
+                # ii. interpolate optimal consumption and hours
+                idx_sol = (t,sim.n[i,t], sim.s[i,t])
+                sim.c[i,t] = interp_2d(par.a_grid,par.k_grids[t],sol.c[idx_sol],sim.a[i,t],sim.k[i,t])
+                sim.h[i,t] = interp_2d(par.a_grid,par.k_grids[t],sol.h[idx_sol],sim.a[i,t],sim.k[i,t])
+
+                # iii. store next-period states
+                if t<par.simT-1:
+                    income_w = self.wage_func(sim.k[i,t],t)*sim.h[i,t]
+                    spouse_income = self.spouse_income_func(sim.s[i,t], t)
+                    income = income_w + spouse_income 
+                    childcare_cost = self.childcare_cost(sim.n[i,t])
+                    
+                    sim.a[i,t+1] = (1+par.r)*(sim.a[i,t] + income - sim.c[i,t] - childcare_cost)
+                    sim.k[i,t+1] = sim.k[i,t] + sim.h[i,t]
+
+                    birth = 0 
+                    if ((draw_uniform <= par.p_birth) & (sim.n[i,t]<(par.Nn-1)) & (sim.s[i,t]==1)):
+                        birth = 1
+                    sim.n[i,t+1] = sim.n[i,t] + birth
+
+    def simulate_numba(self):
+        """ simulate individuals in parallel """
+
+        numba.set_num_threads(self.par.threads)
+
+        use_stream = self.par.sim_draws == 'stream'
+        with jit(self) as model:
+            simulate_jit(model.par,model.sol,model.sim,use_stream,0)
+
+    def simulate_chunks(self,chunk_size=None,folder=None,reducers=(),materialize=False):
+        """ simulate in chunks of individuals with memory bounded by the chunk size
+
+        Args:
+
+            chunk_size (int,optional): individuals per chunk, default is par.sim_chunk
+            folder (str,optional): write the panel to folder/{c,h,a,k,n,s}.npy (memory-mapped)
+            reducers (iterable,optional): callables called as reducer(chunk,i0) after each chunk,
+                where chunk has (N,simT) arrays c,h,a,k,n,s for individuals i0,...,i0+N-1
+            materialize (bool,optional): also store the full panel in .sim
+
+        """
+
+        par = self.par
+        sim = self.sim
+
+        if chunk_size is None: chunk_size = par.sim_chunk
+        assert chunk_size > 0, 'chunk_size must be positive'
+        assert par.sim_draws == 'stream', 'simulation in chunks requires sim_draws = stream'
+
+        numba.set_num_threads(par.threads)
+
+        # a. outputs
+        shape = (par.simN,par.simT)
+        dtypes = {'c':np.float64,'h':np.float64,'a':np.float64,'k':np.float64,'n':np.int_,'s':np.int_}
+
+        if materialize and not sim.c.shape == shape:
+            for key,dtype in dtypes.items():
+                setattr(sim,key,np.zeros(shape,dtype=dtype))
+
+        if folder is not None:
+            os.makedirs(folder,exist_ok=True)
+            store = {key:np.lib.format.open_memmap(f'{folder}/{key}.npy',mode='w+',dtype=dtype,shape=shape) for key,dtype in dtypes.items()}
+
+        # b. loop over chunks
+        with jit(self) as model:
+
+            for i0 in range(0,par.simN,chunk_size):
+
+                N = min(chunk_size,par.simN-i0)
+
+                # i. initial states
+                init = {}
+                for key in ['a_init','k_init','n_init']:
+                    value = getattr(sim,key)
+                    init[key] = value[i0:i0+N] if value.size > 0 else np.zeros(N,dtype=value.dtype)
+
+                # ii. simulate
+                chunk = SimChunk(
+                    c=np.zeros((N,par.simT)),h=np.zeros((N,par.simT)),
+                    a=np.zeros((N,par.simT)),k=np.zeros((N,par.simT)),
+                    n=np.zeros((N,par.simT),dtype=np.int_),s=np.zeros((N,par.simT),dtype=np.int_),
+                    draws_uniform=sim.draws_uniform,draws_uniform_spouse=sim.draws_uniform_spouse,
+                    **init)
+
+                simulate_jit(model.par,model.sol,chunk,True,i0)
+
+                # iii. output
+                for key in dtypes:
+                    if folder is not None: store[key][i0:i0+N] = getattr(chunk,key)
+                    if materialize: getattr(sim,key)[i0:i0+N] = getattr(chunk,key)
+
+                for reducer in reducers:
+                    reducer(chunk,i0)
+
+        if folder is not None:
+            for memmap in store.values(): memmap.flush()
+
+    def simulate_moments(self,variables=('c','h','a','k','birth'),bins=None,chunk_size=None):
+        """ simulate and return moments by (t,n,s) without keeping the panel (see MomentAccumulator) """
+
+        acc = MomentAccumulator(self.par,variables=variables,bins=bins)
+
+        if self.par.sim_chunk > 0 or chunk_size is not None:
+            self.simulate_chunks(chunk_size=chunk_size,reducers=[acc])
+        else:
+            self.simulate()
+            acc(self.sim)
+
+        return acc
+
+    def event_study(self,var='h',min_time=-8,max_time=8,ref=-1,birth='last'):
+        """ mean of a simulated variable by time since birth
+
+        Args:
+
+            var (str): variable in .sim
+            min_time (int): first event time
+            max_time (int): last event time
+            ref (int,optional): event time the means are relative to (None for levels)
+            birth (str,optional): 'last' or 'first' birth defines the event when there are several
+
+        Returns:
+
+            event_grid (numpy.ndarray): event times
+            event_mean (numpy.ndarray): means (relative to ref)
+            event_se (numpy.ndarray): standard errors of the means (of the differences from ref, 
+                accounting for individuals observed at both event times)
+
+        """
+
+        par = self.par
+        sim = self.sim
+
+        if ref is not None and not (min_time <= ref <= max_time):
+            raise ValueError(f'ref = {ref} is outside the event window [{min_time},{max_time}]')
+
+        # a. time of birth (births can only happen from t = 1)
+        births = np.zeros(sim.n.shape,dtype=np.bool_)
+        births[:,1:] = sim.n[:,1:] > sim.n[:,:-1]
+        has_birth = births.any(axis=1)
+
+        if birth == 'last':
+            time_of_birth = par.simT-1 - np.argmax(births[:,::-1],axis=1)
+        elif birth == 'first':
+            time_of_birth = np.argmax(births,axis=1)
+        else:
+            raise ValueError(f'unknown birth: {birth}')
+
+        # b. event time of all observations of individuals with a birth
+        time_since_birth = np.arange(par.simT)[None,:] - time_of_birth[has_birth,None]
+        values = getattr(sim,var)[has_birth]
+
+        I = (time_since_birth >= min_time) & (time_since_birth <= max_time)
+        j = time_since_birth[I] - min_time
+        x = values[I]
+
+        # c. moments in one pass
+        Nevent = max_time-min_time+1
+        N = np.bincount(j,minlength=Nevent)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            event_mean = np.bincount(j,weights=x,minlength=Nevent)/N
+            event_var = np.bincount(j,weights=x**2,minlength=Nevent)/N - event_mean**2
+            event_se = np.sqrt(np.fmax(event_var,0.0)/(N-1))
+
+        event_grid = np.arange(min_time,max_time+1)
+        if ref is None: return event_grid,event_mean,event_se
+
+        # d. differences from ref: var(mean_j - mean_ref) = var(mean_j) + var(mean_ref) - 2*cov(mean_j,mean_ref),
+        # where the covariance comes from individuals observed at both j and ref
+        j_ref = ref - min_time
+        t_ref = time_of_birth[has_birth] + ref
+        has_ref = (t_ref >= 0) & (t_ref < par.simT)
+        x_ref = values[np.arange(values.shape[0]),np.clip(t_ref,0,par.simT-1)]
+
+        J = np.broadcast_to(has_ref[:,None],I.shape)[I]
+        dev = (x[J]-event_mean[j[J]])*(np.broadcast_to(x_ref[:,None],I.shape)[I][J]-event_mean[j_ref])
+        N_both = np.bincount(j[J],minlength=Nevent)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            event_cov = np.bincount(j[J],weights=dev,minlength=Nevent)/np.fmax(N_both-1,1)*N_both/(N*N[j_ref])
+            event_se = np.sqrt(np.fmax(event_se**2 + event_se[j_ref]**2 - 2*event_cov,0.0))
+
+        event_mean = event_mean - event_mean[j_ref]
+
+        return event_grid,event_mean,event_se
+
+    def get_draws(self,t,i0=0,N=None):
+        """ uniform draws for child arrival and spouse for individuals i0,...,i0+N-1 in period t """
+
+        par = self.par
+        sim = self.sim
+
+        if N is None: N = par.simN - i0
+
+        if par.sim_draws == 'stream':
+            draws_uniform = np.empty(N)
+            draws_uniform_spouse = np.empty(N)
+            fill_uniform_draws(par.sim_seed,0,i0,t,draws_uniform)
+            fill_uniform_draws(par.sim_seed,1,i0,t,draws_uniform_spouse)
+            return draws_uniform,draws_uniform_spouse
+        else:
+            return sim.draws_uniform[i0:i0+N,t],sim.draws_uniform_spouse[i0:i0+N,t]
+                    
+
+
+
+
+#########
+# Numba #
+#########
+
+@njit
+def util_jit(par,c,hours,kids):
+
+    beta = par.beta_0 + par.beta_1*kids
+
+    return (c)**(1.0+par.eta) / (1.0+par.eta) - beta*(hours)**(1.0+par.gamma) / (1.0+par.gamma)
+
+@njit
+def untransform_V_jit(par,V_inv):
+
+    if V_inv <= 0.0: return V_infeasible # extrapolated beyond the borrowing limit
+    return V_inv**(1.0+par.eta) / (1.0+par.eta)
+
+@njit
+def wage_func_jit(par,capital,t):
+    # after tax wage rate
+
+    return (1.0 - par.tau )* par.w_vec[t] * (1.0 + par.alpha * capital)
+
+@njit
+def spouse_income_func_jit(par,spouse,t):
+
+    if par.spouse_dummy == 0:
+        return 0.0
+    else:
+        return spouse*(0.1 + 0.01*t)
+
+@njit
+def childcare_cost_jit(par,kids):
+
+    return par.theta * kids
+
+@njit
+def a_next_min_jit(t,kids,k_next,par,sol):
+    """ lowest wealth next period given kids in t and next-period human capital (see compute_feasibility) """
+
+    k_grid_next = par.k_grids[t+1]
+    j_k = grid_search(k_grid_next,par.k_grids_lut[t+1],k_next)
+    w_k = (k_next-k_grid_next[j_k])/(k_grid_next[j_k+1]-k_grid_next[j_k])
+    a_next_min = (1.0-w_k)*sol.a_next_min[t,kids,j_k] + w_k*sol.a_next_min[t,kids,j_k+1]
+
+    return max(a_next_min,par.a_grid[0])
+
+@njit
+def value_of_choice_jit(cons,hours,assets,capital,kids,spouse,t,par,sol):
+
+    # a. penalty for violating bounds
+    penalty = 0.0
+    if cons < 0.0:
+        penalty += cons*1_000.0
+        cons = 1.0e-5
+    if hours < 0.0:
+        penalty += hours*1_000.0
+        hours = 0.0
+
+    # b. next-period states
+    income_w = wage_func_jit(par,capital,t) * hours
+    spouse_income = spouse_income_func_jit(par,spouse,t)
+    income = income_w + spouse_income
+    childcare_cost = childcare_cost_jit(par,kids)
+    a_next = (1.0+par.r)*(assets + income - cons - childcare_cost)
+    k_next = capital + hours
+
+    # penalty for saving less than the natural borrowing limit next period (consumption is lowered to respect it)
+    a_next_min = a_next_min_jit(t,kids,k_next,par,sol)
+    if a_next < a_next_min:
+        penalty += (a_next-a_next_min)*1_000.0
+        cons = max(cons + (a_next-a_next_min)/(1.0+par.r),1.0e-5)
+        a_next = a_next_min
+
+    # c. utility from consumption
+    util = util_jit(par,cons,hours,kids)
+
+    # d. *expected* continuation value from savings
+
+    if par.V_transform and a_next >= par.a_grid[0]: # extrapolated in levels below the grid
+        EV_next = untransform_V_jit(par,interp_2d_lut(par.a_grid,par.a_grid_lut,par.k_grids[t+1],par.k_grids_lut[t+1],sol.EV_inv[t,kids,spouse],a_next,k_next))
+    else:
+        EV_next = interp_2d_lut(par.a_grid,par.a_grid_lut,par.k_grids[t+1],par.k_grids_lut[t+1],sol.EV[t,kids,spouse],a_next,k_next)
+
+    # e. return value of choice (including penalty)
+    return util + par.rho*EV_next + penalty
+
+@njit
+def obj_jit(x,assets,capital,kids,spouse,t,par,sol):
+    return - value_of_choice_jit(x[0],x[1],assets,capital,kids,spouse,t,par,sol)
+
+@njit
+def nelder_mead(obj,x0,step,lb,ub,args=(),tol=1e-8,max_iter=1_000):
+    """ bounded Nelder-Mead optimizer (vertices are clipped to [lb,ub])
+
+    Args:
+
+        obj (callable): function to minimize, called as obj(x,*args)
+        x0 (numpy.ndarray): initial guess
+        step (numpy.ndarray): size of initial simplex in each dimension
+        lb (numpy.ndarray): lower bounds
+        ub (numpy.ndarray): upper bounds
+        args (tuple): additional arguments to the objective function
+        tol (double,optional): tolerance on both x and function value
+        max_iter (int,optional): maximum number of iterations
+
+    Returns:
+
+        x (numpy.ndarray): minimizer
+        fx (double): function value at minimizer
+        success (bool): converged within max_iter
+        nit (int): number of iterations
+        nfev (int): number of function evaluations
+
+    """
+
+    n = x0.size
+    success = False
+    nit = 0
+    nfev = n+1
+
+    # a. initial simplex
+    X = np.empty((n+1,n))
+    F = np.empty(n+1)
+    for i in range(n+1):
+        for j in range(n):
+            X[i,j] = min(max(x0[j],lb[j]),ub[j])
+        if i > 0:
+            j = i-1
+            X[i,j] = X[i,j] + step[j] if X[i,j] + step[j] <= ub[j] else X[i,j] - step[j]
+        F[i] = obj(X[i],*args)
+
+    xc = np.empty(n)
+    xr = np.empty(n)
+    xe = np.empty(n)
+    xk = np.empty(n)
+
+    # b. iterate
+    for _ in range(max_iter):
+
+        # i. sort
+        I = np.argsort(F)
+        X = X[I]
+        F = F[I]
+
+        # ii. convergence
+        if np.max(np.abs(F[1:]-F[0])) <= tol and np.max(np.abs(X[1:]-X[0])) <= tol:
+            success = True
+            break
+
+        nit += 1
+
+        # iii. centroid of best n points
+        for j in range(n):
+            xc[j] = np.mean(X[:n,j])
+
+        # iv. reflect
+        for j in range(n):
+            xr[j] = min(max(2.0*xc[j] - X[n,j],lb[j]),ub[j])
+        fr = obj(xr,*args)
+        nfev += 1
+
+        if fr < F[0]:
+
+            # expand
+            for j in range(n):
+                xe[j] = min(max(3.0*xc[j] - 2.0*X[n,j],lb[j]),ub[j])
+            fe = obj(xe,*args)
+            nfev += 1
+            if fe < fr:
+                X[n] = xe
+                F[n] = fe
+            else:
+                X[n] = xr
+                F[n] = fr
+
+        elif fr < F[n-1]:
+
+            X[n] = xr
+            F[n] = fr
+
+        else:
+
+            # contract (outside if reflection improved on worst point)
+            if fr < F[n]:
+                for j in range(n):
+                    xk[j] = 0.5*(xc[j] + xr[j])
+            else:
+                for j in range(n):
+                    xk[j] = 0.5*(xc[j] + X[n,j])
+            fk = obj(xk,*args)
+            nfev += 1
+
+            if fk < min(fr,F[n]):
+                X[n] = xk
+                F[n] = fk
+            else:
+                # shrink towards best point
+                for i in range(1,n+1):
+                    for j in range(n):
+                        X[i,j] = 0.5*(X[0,j] + X[i,j])
+                    F[i] = obj(X[i],*args)
+                nfev += n
+
+    i = np.argmin(F)
+    return X[i].copy(),F[i],success,nit,nfev
+
+@njit(parallel=True)
+def solve_period_jit(t,par,sol,c0,h0,warm):
+
+    # loop in parallel over (n,s,k) - only sol.V[t+1] is read, so columns are independent
+    for i_nsk in prange(par.Nn*par.Ns*par.Nk):
+
+        i_n = i_nsk // (par.Ns*par.Nk)
+        i_s = (i_nsk // par.Nk) % par.Ns
+        i_k = i_nsk % par.Nk
+
+        solve_column_jit(t,i_n,i_s,i_k,par,sol,c0,h0,warm)
+
+@njit
+def fill_infeasible_jit(t,i_n,i_s,i_a,i_k,par,sol):
+    """ solution in a state below the natural borrowing limit """
+
+    sol.c[t,i_n,i_s,i_a,i_k] = 1e-6
+    sol.h[t,i_n,i_s,i_a,i_k] = par.h_max
+    sol.V[t,i_n,i_s,i_a,i_k] = np.nan
+
+    sol.diag_success[t,i_n,i_s,i_a,i_k] = True
+    sol.diag_nit[t,i_n,i_s,i_a,i_k] = 0
+    sol.diag_nfev[t,i_n,i_s,i_a,i_k] = 0
+
+@njit
+def solve_column_jit(t,i_n,i_s,i_k,par,sol,c0,h0,warm):
+
+    kids = par.n_grid[i_n]
+    spouse = par.spouse_grid[i_s]
+    capital = par.k_grids[t,i_k]
+
+    lb = np.array([1e-6,0.0])
+    ub = np.array([np.inf,par.h_max])
+    step = np.empty(2)
+
+    # serial loop over wealth (warm starts from the previous grid point)
+    for i_a in range(par.Na):
+        assets = par.a_grid[i_a]
+
+        if not sol.feasible[t,i_n,i_s,i_a,i_k]:
+            fill_infeasible_jit(t,i_n,i_s,i_a,i_k,par,sol)
+            continue
+
+        # a. bounds: consumption cannot exceed cash-on-hand at maximum hours less the lowest wealth next period
+        income_max = wage_func_jit(par,capital,t)*par.h_max + spouse_income_func_jit(par,spouse,t)
+        ub[0] = assets + income_max - childcare_cost_jit(par,kids) - a_next_min_jit(t,kids,capital+par.h_max,par,sol)/(1.0+par.r)
+
+        # b. initial guess: warm start, else previous (feasible) grid point in wealth, else next period
+        if warm:
+            x0 = np.array([c0[t,i_n,i_s,i_a,i_k],h0[t,i_n,i_s,i_a,i_k]])
+        elif i_a == 0 or not sol.feasible[t,i_n,i_s,i_a-1,i_k]:
+            x0 = np.array([sol.c[t+1,i_n,i_s,i_a,i_k],sol.h[t+1,i_n,i_s,i_a,i_k]])
+        else:
+            x0 = np.array([sol.c[t,i_n,i_s,i_a-1,i_k],sol.h[t,i_n,i_s,i_a-1,i_k]])
+        step[0] = 0.05*x0[0] + 0.01
+        step[1] = 0.05*x0[1] + 0.01
+
+        # c. optimize
+        args = (assets,capital,kids,spouse,t,par,sol)
+        x,fx,success,nit,nfev = nelder_mead(obj_jit,x0,step,lb,ub,args=args,tol=par.tol,max_iter=par.max_iter)
+
+        # d. polish: re-solve from a cold start if the solution moved far from the warm start (or failed)
+        if warm and par.polish_tol > 0.0:
+            moved = max(abs(x[0]-x0[0])/(1.0+abs(x0[0])),abs(x[1]-x0[1])/(1.0+abs(x0[1])))
+            if not (moved <= par.polish_tol and np.isfinite(fx)):
+                if i_a == 0 or not sol.feasible[t,i_n,i_s,i_a-1,i_k]:
+                    x0_cold = np.array([sol.c[t+1,i_n,i_s,i_a,i_k],sol.h[t+1,i_n,i_s,i_a,i_k]])
+                else:
+                    x0_cold = np.array([sol.c[t,i_n,i_s,i_a-1,i_k],sol.h[t,i_n,i_s,i_a-1,i_k]])
+                step[0] = 0.05*x0_cold[0] + 0.01
+                step[1] = 0.05*x0_cold[1] + 0.01
+                x_cold,fx_cold,success_cold,nit_cold,nfev_cold = nelder_mead(obj_jit,x0_cold,step,lb,ub,args=args,tol=par.tol,max_iter=par.max_iter)
+                nit += nit_cold
+                nfev += nfev_cold
+                if not fx <= fx_cold:
+                    x,fx,success = x_cold,fx_cold,success_cold
+
+        # e. store results
+        sol.c[t,i_n,i_s,i_a,i_k] = x[0]
+        sol.h[t,i_n,i_s,i_a,i_k] = x[1]
+        sol.V[t,i_n,i_s,i_a,i_k] = -fx
+
+        sol.diag_success[t,i_n,i_s,i_a,i_k] = success
+        sol.diag_nit[t,i_n,i_s,i_a,i_k] = nit
+        sol.diag_nfev[t,i_n,i_s,i_a,i_k] = nfev
+
+#################
+# Interpolation #
+#################
+
+def fill_nan_linear(grid,value):
+    """ fill nan in the columns of value (in place) by linear interpolation between and extrapolation from the finite values
+
+    Args:
+
+        grid (numpy.ndarray): 1d grid (along the first axis of value)
+        value (numpy.ndarray): 2d array, columns without finite values are left as nan
+
+    """
+
+    for j in range(value.shape[1]):
+
+        I = np.isfinite(value[:,j])
+        if I.all() or not I.any(): continue
+
+        x = grid[I]
+        y = value[I,j]
+        value[~I,j] = np.interp(grid[~I],x,y)
+
+        # linear extrapolation from the two outermost finite values at each end
+        if x.size > 1:
+            lo = grid < x[0]
+            value[lo,j] = y[0] + (y[1]-y[0])/(x[1]-x[0])*(grid[lo]-x[0])
+            hi = grid > x[-1]
+            value[hi,j] = y[-1] + (y[-1]-y[-2])/(x[-1]-x[-2])*(grid[hi]-x[-1])
+
+def grid_lut(grid,n_bins=None):
+    """ lookup table for grid_search
+
+    The range of the grid is divided into n_bins equally spaced bins. The table holds, 
+    for each bin, the location in the grid (as found by binary_search) of any point 
+    in the bin before its (at most one) interior grid point. 
+
+    Args:
+
+        grid (numpy.ndarray): 1d grid (increasing)
+        n_bins (int,optional): number of bins, default is the smallest number with bins narrower than all grid cells
+
+    Returns:
+
+        lut (numpy.ndarray): location in grid by bin
+
+    """
+
+    if n_bins is None:
+        n_bins = int((grid[-1]-grid[0])/np.min(np.diff(grid))) + 1
+
+    # a. bin of each interior grid point (same computation as in grid_search)
+    while True:
+        bins = ((grid[1:-1]-grid[0])*(n_bins/(grid[-1]-grid[0]))).astype(np.int_)
+        if np.all(np.diff(bins) > 0): break
+        n_bins *= 2 # rounding put two grid points in the same bin
+
+    # b. number of interior grid points in earlier bins
+    return np.searchsorted(bins,np.arange(n_bins),side='left')
+
+@njit(inline='always') # inlined at numba level, LLVM does not inline it into callers
+def grid_search(grid,lut,xi):
+    """ location in grid as binary_search(0,grid.size,grid,xi) in constant time using lut from grid_lut """
+
+    N = grid.size
+
+    # a. extrapolation (and nan)
+    if not xi > grid[0]:
+        return 0
+    elif xi >= grid[N-2]:
+        return N-2
+
+    # b. look up bin and step past its grid point if below xi
+    j = lut[int((xi-grid[0])*(lut.size/(grid[N-1]-grid[0])))]
+    if grid[j+1] <= xi: j += 1
+
+    return j
+
+@njit(inline='always')
+def interp_2d_lut(grid1,lut1,grid2,lut2,value,xi1,xi2):
+    """ as consav's interp_2d with the search done by grid_search """
+
+    j1 = grid_search(grid1,lut1,xi1)
+    j2 = grid_search(grid2,lut2,xi2)
+
+    return _interp_2d(grid1,grid2,value,xi1,xi2,j1,j2)
+
+@njit
+def interp_2d_weights(grid1,lut1,grid2,lut2,xi1,xi2):
+    """ location and relative position in the cell for 2d interpolation at one point
+
+    Args:
+
+        grid1 (numpy.ndarray): 1d grid
+        lut1 (numpy.ndarray): lookup table for grid1 (see grid_lut)
+        grid2 (numpy.ndarray): 1d grid
+        lut2 (numpy.ndarray): lookup table for grid2
+        xi1 (double): input point
+        xi2 (double): input point
+
+    Returns:
+
+        j1 (int): location in grid1
+        j2 (int): location in grid2
+        w1 (double): weight on grid1[j1+1]
+        w2 (double): weight on grid2[j2+1]
+
+    """
+
+    # a. search in each dimension (same extrapolation as consav's interp_2d)
+    j1 = grid_search(grid1,lut1,xi1)
+    j2 = grid_search(grid2,lut2,xi2)
+
+    # b. relative position in the cell
+    w1 = (xi1-grid1[j1])/(grid1[j1+1]-grid1[j1])
+    w2 = (xi2-grid2[j2])/(grid2[j2+1]-grid2[j2])
+
+    return j1,j2,w1,w2
+
+@njit
+def interp_2d_apply(j1,j2,w1,w2,value):
+    """ 2d interpolation of value with location and weights from interp_2d_weights """
+
+    return (1-w1)*(1-w2)*value[j1,j2] + w1*(1-w2)*value[j1+1,j2] + (1-w1)*w2*value[j1,j2+1] + w1*w2*value[j1+1,j2+1]
+
+@njit
+def interp_2d_multi_vec(grid1,lut1,grid2,lut2,values,xi1,xi2,yi):
+    """ 2d interpolation of several arrays for vector of points (search done once per point)
+
+    Args:
+
+        grid1 (numpy.ndarray): 1d grid
+        lut1 (numpy.ndarray): lookup table for grid1 (see grid_lut)
+        grid2 (numpy.ndarray): 1d grid
+        lut2 (numpy.ndarray): lookup table for grid2
+        values (tuple): value arrays (2d)
+        xi1 (numpy.ndarray): input vector
+        xi2 (numpy.ndarray): input vector
+        yi (tuple): output vectors, one per value array
+
+    """
+
+    for i in range(xi1.size):
+        j1,j2,w1,w2 = interp_2d_weights(grid1,lut1,grid2,lut2,xi1[i],xi2[i])
+        for i_v in range(len(values)):
+            yi[i_v][i] = interp_2d_apply(j1,j2,w1,w2,values[i_v])
+
+@njit
+def interp_2d_multi_batch_vec(grid1,lut1,grid2,lut2,values,xi1,xi2,yi):
+    """ 2d interpolation of several arrays for a batch of points
+
+    If xi1 is sorted, the locations in grid1 are found in one sweep over the grid 
+    (a merge of two sorted sequences). Otherwise each point is located with grid_search 
+    as in interp_2d_multi_vec, which is faster than sorting the batch and scattering 
+    the results back. Results are the same either way.
+
+    Args:
+
+        grid1 (numpy.ndarray): 1d grid
+        lut1 (numpy.ndarray): lookup table for grid1 (see grid_lut)
+        grid2 (numpy.ndarray): 1d grid
+        lut2 (numpy.ndarray): lookup table for grid2
+        values (tuple): value arrays (2d)
+        xi1 (numpy.ndarray): input vector
+        xi2 (numpy.ndarray): input vector
+        yi (tuple): output vectors, one per value array
+
+    """
+
+    # a. unsorted (or nan): search for each point
+    for i in range(1,xi1.size):
+        if not xi1[i] >= xi1[i-1]:
+            interp_2d_multi_vec(grid1,lut1,grid2,lut2,values,xi1,xi2,yi)
+            return
+
+    # b. sorted: sweep over grid1 (same location as binary_search)
+    N1 = grid1.size
+    j1 = 0
+    for i in range(xi1.size):
+
+        while j1 < N1-2 and grid1[j1+1] <= xi1[i]: j1 += 1
+        j2 = grid_search(grid2,lut2,xi2[i])
+
+        w1 = (xi1[i]-grid1[j1])/(grid1[j1+1]-grid1[j1])
+        w2 = (xi2[i]-grid2[j2])/(grid2[j2+1]-grid2[j2])
+        for i_v in range(len(values)):
+            yi[i_v][i] = interp_2d_apply(j1,j2,w1,w2,values[i_v])
+
+@njit
+def interp_2d_grad(grid1,lut1,grid2,lut2,value,xi1,xi2):
+    """ 2d interpolation for one point with slopes
+
+    Args:
+
+        grid1 (numpy.ndarray): 1d grid
+        lut1 (numpy.ndarray): lookup table for grid1 (see grid_lut)
+        grid2 (numpy.ndarray): 1d grid
+        lut2 (numpy.ndarray): lookup table for grid2
+        value (numpy.ndarray): value array (2d)
+        xi1 (double): input point
+        xi2 (double): input point
+
+    Returns:
+
+        yi (double): output
+        dyi1 (double): derivative wrt. xi1
+        dyi2 (double): derivative wrt. xi2
+
+    """
+
+    # a. location and relative position in the cell
+    j1,j2,w1,w2 = interp_2d_weights(grid1,lut1,grid2,lut2,xi1,xi2)
+    d1 = grid1[j1+1]-grid1[j1]
+    d2 = grid2[j2+1]-grid2[j2]
+
+    v00 = value[j1,j2]
+    v10 = value[j1+1,j2]
+    v01 = value[j1,j2+1]
+    v11 = value[j1+1,j2+1]
+
+    # c. value and slopes of the bilinear interpolant
+    yi = (1-w1)*(1-w2)*v00 + w1*(1-w2)*v10 + (1-w1)*w2*v01 + w1*w2*v11
+    dyi1 = ((1-w2)*(v10-v00) + w2*(v11-v01))/d1
+    dyi2 = ((1-w1)*(v01-v00) + w1*(v11-v10))/d2
+
+    return yi,dyi1,dyi2
+
+#######
+# EGM #
+#######
+
+@njit
+def compute_q_jit(t,par,sol,q):
+    """ marginal post-decision value, rho*(1+r)*dEV/da_next, in each cell [a_i,a_i+1] of the wealth grid (last cell repeated) 
+    
+    The slopes are those of the linear interpolation of EV used in value_of_choice.
+    
+    """
+
+    for i_n in range(par.Nn):
+        for i_s in range(par.Ns):
+            EV_next = sol.EV[t,i_n,i_s]
+
+            for i_k in range(par.Nk):
+                for i_a in range(par.Na):
+                    i_lo = min(i_a,par.Na-2)
+                    dEV = (EV_next[i_lo+1,i_k]-EV_next[i_lo,i_k])/(par.a_grid[i_lo+1]-par.a_grid[i_lo])
+                    q[i_n,i_s,i_a,i_k] = par.rho*(1.0+par.r)*dEV
+
+@njit
+def egm_cons_jit(m,k_next,i_n,i_s,t,par,sol,q):
+    """ optimal consumption given cash-on-hand and next-period human capital
+
+    With q interpolated in next-period human capital (as the expected value), the marginal value is constant 
+    in each cell of the wealth grid. Inverting the Euler equation gives constant consumption within a cell, 
+    c_j = q_j**(1/eta) for cash-on-hand in [c_j + a_j/(1+r), c_j + a_j+1/(1+r)], and savings fixed at the 
+    grid point between cells. The cell is found by bisection on cash-on-hand.
+
+    """
+
+    # a. location of next-period human capital (linear extrapolation as the expected value)
+    k_grid_next = par.k_grids[t+1]
+    j_k = grid_search(k_grid_next,par.k_grids_lut[t+1],k_next)
+    w_k = (k_next-k_grid_next[j_k])/(k_grid_next[j_k+1]-k_grid_next[j_k])
+
+    # b. borrowing limit binds: save the lowest wealth next period
+    a_next_min = a_next_min_jit(t,i_n,k_next,par,sol)
+    lo = grid_search(par.a_grid,par.a_grid_lut,a_next_min)
+    c_lo = egm_cons_cell_jit(lo,j_k,w_k,i_n,i_s,par,q)
+    if m <= c_lo + a_next_min/(1.0+par.r):
+        return max(m - a_next_min/(1.0+par.r),1e-6)
+
+    # c. last cell with c_j + a_j/(1+r) <= m (the last cell extends beyond the grid)
+    hi = par.Na-1
+    while hi-lo > 1:
+        mid = (lo+hi)//2
+        c_mid = egm_cons_cell_jit(mid,j_k,w_k,i_n,i_s,par,q)
+        if c_mid + par.a_grid[mid]/(1.0+par.r) <= m:
+            lo,c_lo = mid,c_mid
+        else:
+            hi = mid
+
+    # d. interior in the cell or at the grid point after it
+    if lo == par.Na-2 or m <= c_lo + par.a_grid[lo+1]/(1.0+par.r):
+        return c_lo
+    else:
+        return m - par.a_grid[lo+1]/(1.0+par.r)
+
+@njit
+def egm_cons_cell_jit(j,j_k,w_k,i_n,i_s,par,q):
+    """ consumption from the Euler equation in cell j of the wealth grid """
+
+    q_now = (1.0-w_k)*q[i_n,i_s,j,j_k] + w_k*q[i_n,i_s,j,j_k+1]
+    return max(q_now,1e-12)**(1.0/par.eta)
+
+@njit
+def obj_hours_egm_jit(hours,assets,capital,kids,spouse,t,par,sol,q):
+
+    m = assets + wage_func_jit(par,capital,t)*hours + spouse_income_func_jit(par,spouse,t) - childcare_cost_jit(par,kids)
+    cons = egm_cons_jit(m,capital+hours,kids,spouse,t,par,sol,q)
+    return - value_of_choice_jit(cons,hours,assets,capital,kids,spouse,t,par,sol)
+
+@njit(parallel=True)
+def solve_period_egm_jit(t,par,sol,q):
+
+    # loop in parallel over (n,s,k)
+    for i_nsk in prange(par.Nn*par.Ns*par.Nk):
+
+        i_n = i_nsk // (par.Ns*par.Nk)
+        i_s = (i_nsk // par.Nk) % par.Ns
+        i_k = i_nsk % par.Nk
+
+        solve_column_egm_jit(t,i_n,i_s,i_k,par,sol,q)
+
+@njit
+def solve_column_egm_jit(t,i_n,i_s,i_k,par,sol,q):
+
+    kids = par.n_grid[i_n]
+    spouse = par.spouse_grid[i_s]
+    capital = par.k_grids[t,i_k]
+
+    # number of golden-section iterations (fixed by the bracket and tolerance)
+    nit = int(np.ceil(np.log(par.tol/par.h_max)/np.log((np.sqrt(5)-1)/2))) if par.h_max > par.tol else 0
+
+    for i_a in range(par.Na):
+        assets = par.a_grid[i_a]
+
+        if not sol.feasible[t,i_n,i_s,i_a,i_k]:
+            fill_infeasible_jit(t,i_n,i_s,i_a,i_k,par,sol)
+            continue
+
+        # a. optimal hours
+        args = (assets,capital,kids,spouse,t,par,sol,q)
+        hours = golden_section_search.optimizer(obj_hours_egm_jit,0.0,par.h_max,args=args,tol=par.tol)
+
+        # b. implied consumption and value
+        m = assets + wage_func_jit(par,capital,t)*hours + spouse_income_func_jit(par,spouse,t) - childcare_cost_jit(par,kids)
+        cons = egm_cons_jit(m,capital+hours,i_n,i_s,t,par,sol,q)
+
+        sol.c[t,i_n,i_s,i_a,i_k] = cons
+        sol.h[t,i_n,i_s,i_a,i_k] = hours
+        sol.V[t,i_n,i_s,i_a,i_k] = value_of_choice_jit(cons,hours,assets,capital,kids,spouse,t,par,sol)
+
+        sol.diag_success[t,i_n,i_s,i_a,i_k] = np.isfinite(sol.V[t,i_n,i_s,i_a,i_k])
+        sol.diag_nit[t,i_n,i_s,i_a,i_k] = nit
+        sol.diag_nfev[t,i_n,i_s,i_a,i_k] = nit+1
+
+#######
+# VFI #
+#######
+
+@njit(parallel=True)
+def compute_EV_k_jit(t,par,sol,EV_k):
+    """ expected value at each savings choice (on the wealth grid) and next-period human capital k+h, -inf below the lowest wealth next period """
+
+    k_grid_next = par.k_grids[t+1]
+
+    for i_nsk in prange(par.Nn*par.Ns*par.Nk):
+
+        i_n = i_nsk // (par.Ns*par.Nk)
+        i_s = (i_nsk // par.Nk) % par.Ns
+        i_k = i_nsk % par.Nk
+
+        for i_h in range(par.Nh):
+
+            # a. location of next-period human capital (linear extrapolation as interp_2d)
+            k_next = par.k_grids[t,i_k] + par.h_grid[i_h]
+            j_k = grid_search(k_grid_next,par.k_grids_lut[t+1],k_next)
+            w_k = (k_next-k_grid_next[j_k])/(k_grid_next[j_k+1]-k_grid_next[j_k])
+            a_next_min = a_next_min_jit(t,i_n,k_next,par,sol)
+
+            # b. interpolate for all savings choices
+            for i_ap in range(par.Na):
+                if par.a_grid[i_ap] < a_next_min:
+                    EV_k[i_n,i_s,i_k,i_h,i_ap] = -np.inf
+                elif par.V_transform:
+                    EV_inv = (1.0-w_k)*sol.EV_inv[t,i_n,i_s,i_ap,j_k] + w_k*sol.EV_inv[t,i_n,i_s,i_ap,j_k+1]
+                    EV_k[i_n,i_s,i_k,i_h,i_ap] = untransform_V_jit(par,EV_inv)
+                else:
+                    EV_k[i_n,i_s,i_k,i_h,i_ap] = (1.0-w_k)*sol.EV[t,i_n,i_s,i_ap,j_k] + w_k*sol.EV[t,i_n,i_s,i_ap,j_k+1]
+
+@njit
+def obj_hours_vfi_jit(hours,a_next,assets,capital,kids,spouse,t,par,sol):
+    """ minus value of hours given next-period wealth """
+
+    m = assets + wage_func_jit(par,capital,t)*hours + spouse_income_func_jit(par,spouse,t) - childcare_cost_jit(par,kids)
+    cons = m - a_next/(1.0+par.r)
+    return - value_of_choice_jit(cons,hours,assets,capital,kids,spouse,t,par,sol)
+
+@njit
+def obj_cons_vfi_jit(cons,hours,assets,capital,kids,spouse,t,par,sol):
+    """ minus value of consumption given hours """
+
+    return - value_of_choice_jit(cons,hours,assets,capital,kids,spouse,t,par,sol)
+
+@njit(parallel=True)
+def solve_period_vfi_jit(t,par,sol,income,disutil,EV_k):
+
+    # loop in parallel over (n,s,k)
+    for i_nsk in prange(par.Nn*par.Ns*par.Nk):
+
+        i_n = i_nsk // (par.Ns*par.Nk)
+        i_s = (i_nsk // par.Nk) % par.Ns
+        i_k = i_nsk % par.Nk
+
+        solve_column_vfi_jit(t,i_n,i_s,i_k,par,sol,income,disutil,EV_k)
+
+@njit
+def solve_column_vfi_jit(t,i_n,i_s,i_k,par,sol,income,disutil,EV_k):
+
+    kids = par.n_grid[i_n]
+    spouse = par.spouse_grid[i_s]
+    capital = par.k_grids[t,i_k]
+    childcare_cost = childcare_cost_jit(par,kids)
+    inv_phi = (np.sqrt(5)-1)/2
+
+    for i_a in range(par.Na):
+        assets = par.a_grid[i_a]
+
+        if not sol.feasible[t,i_n,i_s,i_a,i_k]:
+            fill_infeasible_jit(t,i_n,i_s,i_a,i_k,par,sol)
+            continue
+
+        # a. maximum over hours and savings
+        V_max = -np.inf
+        i_h_max = -1
+        i_ap_max = -1
+        nfev = 0
+        for i_h in range(par.Nh):
+            m = assets + income[i_s,i_k,i_h] - childcare_cost
+            for i_ap in range(par.Na):
+                cons = m - par.a_grid[i_ap]/(1.0+par.r)
+                if cons <= 0.0: break # consumption is decreasing in savings
+                V = cons**(1.0+par.eta) / (1.0+par.eta) - disutil[i_n,i_h] + par.rho*EV_k[i_n,i_s,i_k,i_h,i_ap]
+                nfev += 1
+                if V > V_max:
+                    V_max = V
+                    i_h_max = i_h
+                    i_ap_max = i_ap
+
+        nit = 0
+        if i_h_max < 0:
+
+            # no positive consumption on the choice grids above the lowest wealth next period: 
+            # search over consumption at maximum hours, saving at least the lowest wealth next period
+            hours = par.h_max
+            m = assets + wage_func_jit(par,capital,t)*hours + spouse_income_func_jit(par,spouse,t) - childcare_cost
+            c_hi = m - a_next_min_jit(t,kids,capital+hours,par,sol)/(1.0+par.r)
+
+            if not c_hi > 1e-6: # below the limit given the interpolated lowest wealth next period
+                fill_infeasible_jit(t,i_n,i_s,i_a,i_k,par,sol)
+                sol.feasible[t,i_n,i_s,i_a,i_k] = False
+                continue
+
+            args = (hours,assets,capital,kids,spouse,t,par,sol)
+            cons = golden_section_search.optimizer(obj_cons_vfi_jit,1e-6,c_hi,args=args,tol=par.tol)
+            V_max = value_of_choice_jit(cons,hours,assets,capital,kids,spouse,t,par,sol)
+
+            n = int(np.ceil(np.log(par.tol/c_hi)/np.log(inv_phi))) if c_hi > par.tol else 0
+            nit += n
+            nfev += n+1
+
+        else:
+
+            hours = par.h_grid[i_h_max]
+            a_next = par.a_grid[i_ap_max]
+            cons = assets + income[i_s,i_k,i_h_max] - childcare_cost - a_next/(1.0+par.r)
+
+            # b. polish: hours given savings, then consumption given hours (bracketed by the neighbouring grid points)
+            if par.vfi_polish:
+
+                h_lo = par.h_grid[max(i_h_max-1,0)]
+                h_hi = par.h_grid[min(i_h_max+1,par.Nh-1)]
+                args = (a_next,assets,capital,kids,spouse,t,par,sol)
+                hours_polish = golden_section_search.optimizer(obj_hours_vfi_jit,h_lo,h_hi,args=args,tol=par.tol)
+
+                m = assets + wage_func_jit(par,capital,t)*hours_polish + spouse_income_func_jit(par,spouse,t) - childcare_cost
+                a_next_lo = max(par.a_grid[max(i_ap_max-1,0)],a_next_min_jit(t,kids,capital+hours_polish,par,sol))
+                c_lo = max(m - par.a_grid[min(i_ap_max+1,par.Na-1)]/(1.0+par.r),1e-6)
+                c_hi = max(m - a_next_lo/(1.0+par.r),c_lo)
+                args = (hours_polish,assets,capital,kids,spouse,t,par,sol)
+                cons_polish = golden_section_search.optimizer(obj_cons_vfi_jit,c_lo,c_hi,args=args,tol=par.tol)
+
+                V_polish = value_of_choice_jit(cons_polish,hours_polish,assets,capital,kids,spouse,t,par,sol)
+                for dist in (h_hi-h_lo,c_hi-c_lo):
+                    if dist > par.tol:
+                        n = int(np.ceil(np.log(par.tol/dist)/np.log(inv_phi)))
+                        nit += n
+                        nfev += n+1
+
+                if V_polish >= V_max:
+                    cons,hours,V_max = cons_polish,hours_polish,V_polish
+
+        # c. store
+        sol.c[t,i_n,i_s,i_a,i_k] = cons
+        sol.h[t,i_n,i_s,i_a,i_k] = hours
+        sol.V[t,i_n,i_s,i_a,i_k] = V_max
+
+        sol.diag_success[t,i_n,i_s,i_a,i_k] = np.isfinite(V_max)
+        sol.diag_nit[t,i_n,i_s,i_a,i_k] = nit
+        sol.diag_nfev[t,i_n,i_s,i_a,i_k] = nfev
+
+##############
+# Simulation #
+##############
+
+@njit
+def splitmix64(x):
+    """ splitmix64 bit mixer (x is np.uint64) """
+
+    z = x + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+@njit
+def uniform_draw(seed,stream,i,t):
+    """ counter-based uniform draw in [0,1)
+
+    The draw is a hash of (seed,stream,i,t), so it does not depend on
+    the order individuals are simulated in or on the number of threads.
+
+    """
+
+    x = splitmix64(np.uint64(seed))
+    x = splitmix64(x ^ np.uint64(stream))
+    x = splitmix64(x ^ np.uint64(i))
+    x = splitmix64(x ^ np.uint64(t))
+    return (x >> np.uint64(11)) * (1.0/9007199254740992.0) # 53 random bits
+
+@njit
+def fill_uniform_draws(seed,stream,i0,t,out):
+    for j in range(out.size):
+        out[j] = uniform_draw(seed,stream,i0+j,t)
+
+# simulation arrays for a chunk of individuals (same fields as .sim)
+SimChunk = namedtuple('SimChunk',['c','h','a','k','n','s','draws_uniform','draws_uniform_spouse','a_init','k_init','n_init'])
+
+@njit(parallel=True)
+def simulate_jit(par,sol,sim,use_stream,i0):
+    """ simulate the individuals in sim, who are individuals i0,i0+1,... in the population """
+
+    for i in prange(sim.c.shape[0]):
+        simulate_individual_jit(i,i0+i,par,sol,sim,use_stream)
+
+@njit
+def simulate_individual_jit(i,i_pop,par,sol,sim,use_stream):
+
+    # a. initialize states
+    sim.n[i,0] = sim.n_init[i]
+    sim.a[i,0] = sim.a_init[i]
+    sim.k[i,0] = sim.k_init[i]
+
+    for t in range(par.simT):
+
+        if use_stream:
+            draw_uniform = uniform_draw(par.sim_seed,0,i_pop,t)
+            draw_uniform_spouse = uniform_draw(par.sim_seed,1,i_pop,t)
+        else:
+            draw_uniform = sim.draws_uniform[i,t]
+            draw_uniform_spouse = sim.draws_uniform_spouse[i,t]
+
+        # b. spouse
+        spouse = 1 if draw_uniform_spouse <= par.p_spouse else 0
+        sim.s[i,t] = spouse
+
+        # c. interpolate optimal consumption and hours
+        kids = sim.n[i,t]
+        j1,j2,w1,w2 = interp_2d_weights(par.a_grid,par.a_grid_lut,par.k_grids[t],par.k_grids_lut[t],sim.a[i,t],sim.k[i,t])
+        sim.c[i,t] = interp_2d_apply(j1,j2,w1,w2,sol.c[t,kids,spouse])
+        sim.h[i,t] = interp_2d_apply(j1,j2,w1,w2,sol.h[t,kids,spouse])
+
+        # d. store next-period states
+        if t < par.simT-1:
+            income_w = wage_func_jit(par,sim.k[i,t],t)*sim.h[i,t]
+            spouse_income = spouse_income_func_jit(par,spouse,t)
+            income = income_w + spouse_income
+            childcare_cost = childcare_cost_jit(par,kids)
+
+            sim.a[i,t+1] = (1+par.r)*(sim.a[i,t] + income - sim.c[i,t] - childcare_cost)
+            sim.k[i,t+1] = sim.k[i,t] + sim.h[i,t]
+
+            birth = 0
+            if draw_uniform <= par.p_birth and kids < par.Nn-1 and spouse == 1:
+                birth = 1
+            sim.n[i,t+1] = kids + birth
+
+###########
+# Moments #
+###########
+
+class MomentAccumulator():
+    """ streaming counts, means, variances and histograms of simulated variables by (t,n,s)
+
+    Update with a panel (or a chunk of it) by calling acc(sim) - it can be passed as
+    a reducer to simulate_chunks() - or period by period with acc.update_period().
+    Chunks are merged with the parallel algorithm of Chan et al., so only arrays of
+    size T x Nn x Ns (x number of bins) are kept.
+
+    'birth' is available as a derived variable (1 if the number of children increased since t-1).
+
+    """
+
+    def __init__(self,par,variables=('c','h','a','k','birth'),bins=None):
+
+        self.T = par.simT
+        self.Nn = par.Nn
+        self.Ns = par.Ns
+        self.variables = tuple(variables)
+        self.bins = {} if bins is None else {var:np.asarray(edges,dtype=float) for var,edges in bins.items()}
+
+        shape = (self.T,self.Nn,self.Ns)
+        self.N = np.zeros(shape)
+        self.mean_ = {var:np.zeros(shape) for var in self.variables}
+        self.M2 = {var:np.zeros(shape) for var in self.variables}
+        self.hist_ = {var:np.zeros(shape+(edges.size-1,)) for var,edges in self.bins.items()}
+
+    def __call__(self,sim,i0=0):
+        """ update with all periods of a panel (i0 is not used, only for the reducer interface) """
+
+        for t in range(self.T):
+            values = {}
+            for var in set(self.variables) | set(self.bins):
+                if var == 'birth':
+                    values[var] = (sim.n[:,t] > sim.n[:,t-1]).astype(float) if t > 0 else np.zeros(sim.n.shape[0])
+                else:
+                    values[var] = getattr(sim,var)[:,t]
+            self.update_period(t,sim.n[:,t],sim.s[:,t],values)
+
+    def update_period(self,t,n,s,values):
+        """ update period t with states n and s and a dict of values """
+
+        G = self.Nn*self.Ns
+        g = n*self.Ns + s
+
+        N_b = np.bincount(g,minlength=G).astype(float)
+        N_a = self.N[t].ravel()
+        N = N_a + N_b
+        I = N_b > 0
+
+        for var in self.variables:
+
+            x = values[var]
+
+            # a. moments of the new observations
+            mean_b = np.zeros(G)
+            mean_b[I] = np.bincount(g,weights=x,minlength=G)[I]/N_b[I]
+            M2_b = np.bincount(g,weights=(x-mean_b[g])**2,minlength=G)
+
+            # b. merge
+            mean_a = self.mean_[var][t].ravel()
+            delta = mean_b - mean_a
+            mean = mean_a.copy()
+            mean[I] += delta[I]*N_b[I]/N[I]
+            M2 = self.M2[var][t].ravel() + M2_b
+            M2[I] += delta[I]**2*N_a[I]*N_b[I]/N[I]
+
+            self.mean_[var][t] = mean.reshape(self.Nn,self.Ns)
+            self.M2[var][t] = M2.reshape(self.Nn,self.Ns)
+
+        for var,edges in self.bins.items():
+            Nbins = edges.size-1
+            j = np.searchsorted(edges,values[var],side='right')-1
+            j[values[var] == edges[-1]] = Nbins-1 # right edge included, as in np.histogram
+            J = (j >= 0) & (j < Nbins)
+            self.hist_[var][t] += np.bincount(g[J]*Nbins+j[J],minlength=G*Nbins).reshape(self.Nn,self.Ns,Nbins)
+
+        self.N[t] = N.reshape(self.Nn,self.Ns)
+
+    def _axes(self,by):
+        return tuple(i for i,key in enumerate(('t','n','s')) if not key in by)
+
+    def count(self,by=('t',)):
+        """ number of observations by a subset of ('t','n','s') """
+
+        return self.N.sum(axis=self._axes(by))
+
+    def mean(self,var,by=('t',)):
+        """ mean of var by a subset of ('t','n','s') """
+
+        axes = self._axes(by)
+        N = self.N.sum(axis=axes)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            return (self.N*self.mean_[var]).sum(axis=axes)/N
+
+    def var(self,var,by=('t',),ddof=0):
+        """ variance of var by a subset of ('t','n','s') """
+
+        axes = self._axes(by)
+        N = self.N.sum(axis=axes,keepdims=True)
+        with np.errstate(invalid='ignore',divide='ignore'):
+            mean = (self.N*self.mean_[var]).sum(axis=axes,keepdims=True)/N
+            M2 = (self.M2[var] + self.N*(self.mean_[var]-np.nan_to_num(mean))**2).sum(axis=axes,keepdims=True)
+            return np.squeeze(M2/(N-ddof),axis=axes)
+
+    def hist(self,var,by=('t',)):
+        """ histogram counts of var by a subset of ('t','n','s'), last axis is the bins """
+
+        return self.hist_[var].sum(axis=self._axes(by))
+
+##########
+# Sweeps #
+##########
+
+# state of a sweep worker process
+_sweep_model = None
+_sweep_moments_fn = None
+
+# parameters used in allocate()
+_allocate_pars = ('T','Na','Nk','Nn','Ns','a_min','a_max','k_max','k_reachable','k_init_max','h_max','Nh','V_transform','w','simN','sim_seed','sim_draws','sim_chunk')
+
+def _sweep_init(model,moments_fn,threads=1):
+    """ set the model and moments function of a sweep worker """
+
+    global _sweep_model, _sweep_moments_fn
+
+    _sweep_model = model
+    _sweep_moments_fn = moments_fn
+    _sweep_model.par.threads = threads
+
+def _sweep_point(point):
+    """ solve, simulate and compute moments for a point of the sweep """
+
+    # a. copy and update parameters
+    model = _sweep_model.copy()
+    for key,value in point.items(): setattr(model.par,key,value)
+
+    if any(key in _allocate_pars for key in point):
+        model.allocate()
+        for key,value in point.items(): setattr(model.par,key,value)
+
+    # b. solve and simulate
+    model.solve()
+    model.simulate()
+
+    return _sweep_moments_fn(model)